@@ -0,0 +1,46 @@
+from hashlib import sha256
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from recipes.cache import state_cache
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+
+def token_cache_key(key):
+    # В имени ключа кеша только хеш: список ключей не выдаёт токены.
+    return f'api:auth-token:{sha256(key.encode()).hexdigest()}'
+
+
+def forget_tokens(keys):
+    state_cache.delete_many([token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication, которая держит токен вместе с пользователем
+    в кеше AUTH_TOKEN_CACHE_TIMEOUT секунд, чтобы не читать их из базы
+    на каждом запросе. Выход, смена пароля, блокировка и любое
+    сохранение пользователя удаляют запись из кеша (api/signals.py).
+    Счётчики пользователя меняются через update() мимо post_save,
+    поэтому в кеш не попадают: обращение к ним читает базу, а save()
+    закешированного пользователя их не перезаписывает.
+    """
+    deferred_user_fields = ('user__recipes_count', 'user__followers_count')
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        token = state_cache.get(cache_key)
+        if token is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user').defer(
+                    *self.deferred_user_fields).get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            state_cache.set(
+                cache_key, token, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return token.user, token
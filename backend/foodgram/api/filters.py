@@ -1,7 +1,15 @@
+from django.conf import settings
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filter
 from django_filters.rest_framework import FilterSet
-from recipes.models import Ingredient, Recipe, Tag
-from rest_framework.filters import SearchFilter
+from recipes.models import Favorite, Recipe, RecipeTag, ShoppingCart, Tag
+from recipes.search import ingredient_index, order_by_ids, search_recipes
+from rest_framework.filters import BaseFilterBackend
+
+RECIPE_ORDERINGS = {
+    'popular': ('-favorites_count', '-pub_date'),
+    'trending': ('-trending_score', '-pub_date'),
+}
 
 
 class RecipeFilter(FilterSet):
@@ -9,17 +17,77 @@ class RecipeFilter(FilterSet):
         field_name='tags__slug',
         queryset=Tag.objects.all(),
         label='Tags',
-        to_field_name='slug'
+        to_field_name='slug',
+        method='filter_tags'
+    )
+    author = filter.NumberFilter(field_name='author_id')
+    is_favorited = filter.BooleanFilter(method='filter_is_favorited')
+    is_in_shopping_cart = filter.BooleanFilter(
+        method='filter_is_in_shopping_cart'
+    )
+    search = filter.CharFilter(method='filter_search')
+    ordering = filter.ChoiceFilter(
+        choices=(('popular', 'Популярные'), ('trending', 'Набирающие')),
+        method='filter_ordering'
     )
 
     class Meta:
         model = Recipe
-        fields = ('tags',)
+        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search', 'ordering')
+
+    def filter_tags(self, queryset, name, tags):
+        """Фильтр по тегам без JOIN и DISTINCT: рецепт попадает в выборку
+        один раз, если у него есть хотя бы один из тегов."""
+        if not tags:
+            return queryset
+        return queryset.annotate(
+            has_tags=Exists(RecipeTag.objects.filter(
+                recipe=OuterRef('pk'), tag__in=tags))
+        ).filter(has_tags=True)
+
+    def filter_user_relation(self, queryset, model, value):
+        if not value:
+            return queryset
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.none()
+        alias = f'in_{model._meta.model_name}'
+        return queryset.annotate(**{
+            alias: Exists(model.objects.filter(
+                user=user, recipe=OuterRef('pk')))
+        }).filter(**{alias: True})
 
+    def filter_is_favorited(self, queryset, name, value):
+        return self.filter_user_relation(queryset, Favorite, value)
 
-class IngredientFilter(SearchFilter):
+    def filter_is_in_shopping_cart(self, queryset, name, value):
+        return self.filter_user_relation(queryset, ShoppingCart, value)
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию и описанию; выдача
+        сортируется по релевантности, если не задан ordering. Объявлен
+        после остальных фильтров, чтобы искать среди уже отобранных
+        рецептов."""
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
+
+    def filter_ordering(self, queryset, name, value):
+        """Сортировка по заранее посчитанным счётчикам, которые покрыты
+        индексами, поэтому страница читается без агрегации."""
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
+
+
+class IngredientFilter(BaseFilterBackend):
+    """Поиск ингредиентов по началу названия или слова в нём через
+    индекс в памяти; в выдаче не больше INGREDIENT_SEARCH_LIMIT записей."""
     search_param = 'name'
 
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        ingredient_index.ensure_fresh()
+        return order_by_ids(queryset, ingredient_index.search(
+            query, settings.INGREDIENT_SEARCH_LIMIT))
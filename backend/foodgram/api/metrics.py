@@ -0,0 +1,250 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections
+from recipes.cache import state_cache
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('total', 'app', 'render', 'db', 'queries')
+# Верхние границы корзин гистограмм: миллисекунды для времени
+# и штуки для количества запросов к базе.
+TIME_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+# Список представлений: счётчик слотов, слоты с именами и метка
+# «уже зарегистрировано» на каждое представление.
+VIEWS_KEY = 'metrics:views'
+# Суммы хранятся целыми числами в тысячных долях, чтобы не терять
+# короткие замеры при округлении.
+SUM_SCALE = 1000
+
+
+def buckets_for(metric):
+    return QUERY_BUCKETS if metric == 'queries' else TIME_BUCKETS
+
+
+def bucket_label(bounds, index):
+    return str(bounds[index]) if index < len(bounds) else 'inf'
+
+
+def incr(key, delta=1):
+    """Атомарно увеличивает счётчик в кеше и возвращает новое значение."""
+    try:
+        return state_cache.incr(key, delta)
+    except ValueError:
+        if state_cache.add(key, delta, timeout=None):
+            return delta
+        return state_cache.incr(key, delta)
+
+
+def register_view(view):
+    """Запоминает имя представления в общем списке, чтобы сводка знала,
+    какие ключи читать из кеша. state_cache.add пропускает только первый
+    процесс, поэтому одновременные регистрации не теряют друг друга."""
+    if state_cache.add(f'{VIEWS_KEY}:registered:{view}', True, timeout=None):
+        state_cache.set(f'{VIEWS_KEY}:{incr(VIEWS_KEY)}', view, timeout=None)
+
+
+def registered_views():
+    count = state_cache.get(VIEWS_KEY, 0)
+    slots = [f'{VIEWS_KEY}:{number}' for number in range(1, count + 1)]
+    return sorted(set(state_cache.get_many(slots).values()))
+
+
+class MetricsBuffer:
+    """
+    Счётчики процесса. Запрос только прибавляет к ним свои значения,
+    а в общий кеш они уходят не чаще раза в REQUEST_METRICS_FLUSH_SECONDS:
+    по одному incr на изменившийся ключ за все запросы интервала.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.views = set()
+        self.flushed = time.monotonic()
+
+    def add(self, view, deltas):
+        with self.lock:
+            self.views.add(view)
+            self.counters.update(deltas)
+            due = (time.monotonic() - self.flushed
+                   >= settings.REQUEST_METRICS_FLUSH_SECONDS)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            counters, self.counters = self.counters, Counter()
+            views, self.views = self.views, set()
+            self.flushed = time.monotonic()
+        for view in views:
+            register_view(view)
+        for key, delta in counters.items():
+            if delta:
+                incr(key, delta)
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.views.clear()
+
+
+buffer = MetricsBuffer()
+
+
+class QueryCounter:
+    """Обёртка для connection.execute_wrapper: считает запросы и время
+    в базе, не требуя DEBUG."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+class RequestMetrics:
+    """
+    Замеры одного запроса. Время сериализации отдельно не выделяется:
+    DRF сериализует данные внутри представления, поэтому оно входит
+    в app — время Python без базы и рендеринга ответа.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = None
+        self.queries = QueryCounter()
+        self.render_started = None
+        self.render = 0.0
+
+    def start_render(self):
+        self.render_started = time.perf_counter()
+
+    def end_render(self):
+        self.render = time.perf_counter() - self.render_started
+
+    def wrap_connections(self):
+        return [
+            connection.execute_wrapper(self.queries)
+            for connection in connections.all()
+        ]
+
+    def finish(self):
+        total = (time.perf_counter() - self.started) * 1000
+        db = self.queries.duration * 1000
+        render = self.render * 1000
+        return {
+            'total': total,
+            'app': max(total - db - render, 0),
+            'render': render,
+            'db': db,
+            'queries': self.queries.count,
+        }
+
+
+def server_timing(values):
+    return ', '.join((
+        f'total;dur={values["total"]:.1f}',
+        f'app;dur={values["app"]:.1f}',
+        f'render;dur={values["render"]:.1f}',
+        f'db;dur={values["db"]:.1f};desc="{values["queries"]} queries"',
+    ))
+
+
+def is_slow(values):
+    return (values['total'] > settings.REQUEST_METRICS_SLOW_MS
+            or values['queries'] > settings.REQUEST_METRICS_MAX_QUERIES)
+
+
+def record(view, values):
+    deltas = {f'metrics:{view}:requests': 1}
+    if is_slow(values):
+        deltas[f'metrics:{view}:slow'] = 1
+        logger.warning(
+            'Медленный запрос %s: %.0f мс, запросов к базе %d (%.0f мс)',
+            view, values['total'], values['queries'], values['db'])
+    for metric in METRICS:
+        value = values[metric]
+        bounds = buckets_for(metric)
+        bucket = bucket_label(bounds, bisect_left(bounds, value))
+        deltas[f'metrics:{view}:{metric}:sum'] = round(value * SUM_SCALE)
+        deltas[f'metrics:{view}:{metric}:{bucket}'] = 1
+    buffer.add(view, deltas)
+
+
+def percentile(bounds, histogram, count, share):
+    """Верхняя граница корзины, в которую попадает заданная доля
+    запросов."""
+    threshold = count * share
+    seen = 0
+    for index in range(len(bounds) + 1):
+        seen += histogram[bucket_label(bounds, index)]
+        if seen >= threshold:
+            return bucket_label(bounds, index)
+    return 'inf'
+
+
+def view_keys(view):
+    keys = [f'metrics:{view}:requests', f'metrics:{view}:slow']
+    for metric in METRICS:
+        bounds = buckets_for(metric)
+        keys.append(f'metrics:{view}:{metric}:sum')
+        keys.extend(
+            f'metrics:{view}:{metric}:{bucket_label(bounds, index)}'
+            for index in range(len(bounds) + 1)
+        )
+    return keys
+
+
+def view_summary(view):
+    values = state_cache.get_many(view_keys(view))
+    count = values.get(f'metrics:{view}:requests', 0)
+    summary = {
+        'requests': count,
+        'slow': values.get(f'metrics:{view}:slow', 0),
+    }
+    if not count:
+        return summary
+    for metric in METRICS:
+        bounds = buckets_for(metric)
+        histogram = {
+            bucket_label(bounds, index): values.get(
+                f'metrics:{view}:{metric}:{bucket_label(bounds, index)}', 0)
+            for index in range(len(bounds) + 1)
+        }
+        summary[metric] = {
+            'avg': round(values.get(f'metrics:{view}:{metric}:sum', 0)
+                         / SUM_SCALE / count, 1),
+            'p50': percentile(bounds, histogram, count, 0.5),
+            'p95': percentile(bounds, histogram, count, 0.95),
+            'histogram': histogram,
+        }
+    return summary
+
+
+def summary():
+    buffer.flush()
+    return {view: view_summary(view) for view in registered_views()}
+
+
+def reset():
+    buffer.clear()
+    views = registered_views()
+    keys = [VIEWS_KEY]
+    keys.extend(
+        f'{VIEWS_KEY}:{number}'
+        for number in range(1, state_cache.get(VIEWS_KEY, 0) + 1))
+    for view in views:
+        keys.append(f'{VIEWS_KEY}:registered:{view}')
+        keys.extend(view_keys(view))
+    state_cache.delete_many(keys)
@@ -0,0 +1,56 @@
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .metrics import RequestMetrics, record, server_timing
+
+
+def view_name(request, view_func):
+    """Имя представления для сводки: класс и действие у вьюсетов DRF,
+    модуль и функция у остальных."""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    method = request.method.lower()
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{cls.__name__}.{actions.get(method, method)}'
+
+
+class RequestMetricsMiddleware:
+    """
+    Считает для каждого запроса число запросов к базе, время в базе,
+    время рендеринга и общее время, копит гистограммы по представлениям
+    в памяти процесса, периодически сбрасывая их в кеш (api/metrics.py),
+    и при SERVER_TIMING_HEADER отдаёт замеры в заголовке
+    Server-Timing. Запросы к базе при потоковой отдаче ответа
+    не учитываются.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.metrics = metrics = RequestMetrics()
+        with ExitStack() as stack:
+            for wrapper in metrics.wrap_connections():
+                stack.enter_context(wrapper)
+            response = self.get_response(request)
+        if metrics.view is None:
+            return response
+        values = metrics.finish()
+        record(metrics.view, values)
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = server_timing(values)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics.view = view_name(request, view_func)
+
+    def process_template_response(self, request, response):
+        request.metrics.start_render()
+        response.add_post_render_callback(
+            lambda response: request.metrics.end_render())
+        return response
@@ -1,6 +1,205 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CachedCountPaginator(Paginator):
+    """Пагинатор, который кеширует COUNT(*) по тексту запроса на
+    PAGINATION_COUNT_CACHE_TIMEOUT секунд (0 — не кешировать)."""
+
+    @cached_property
+    def count(self):
+        timeout = settings.PAGINATION_COUNT_CACHE_TIMEOUT
+        if not timeout or not hasattr(self.object_list, 'query'):
+            return super().count
+        try:
+            sql, params = self.object_list.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = 'pagination:count:' + md5(
+            f'{sql}:{params}'.encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, timeout)
+        return count
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу: следующая страница — строки, которые идут после
+    последней строки предыдущей в порядке ordering. Сравнение кортежей
+    (a, b) < (a0, b0) раскрывается в a < a0 OR (a = a0 AND b < b0), так
+    что запрос на любой глубине читает индекс по ordering без OFFSET.
+    Поля ordering не должны быть NULL, последнее из них должно быть
+    уникальным; курсор хранит их значения у последней строки страницы.
+    """
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Неверный курсор'
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param, '')
+        if value.isdigit() and int(value):
+            return min(int(value), self.max_page_size)
+        return self.page_size
+
+    def decode_cursor(self, request):
+        value = request.query_params.get(self.cursor_query_param)
+        if not value:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(value.encode()))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(
+                self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, position):
+        value = urlsafe_b64encode(json.dumps(position).encode())
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, value.decode())
+
+    def get_position(self, obj):
+        position = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip('-'))
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            position.append(value)
+        return position
+
+    def after(self, position):
+        """Условие «строка идёт после position» в порядке ordering."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = remove_query_param(
+            request.build_absolute_uri(), self.cursor_query_param)
+        size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.after(position))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+        rows = list(queryset[:size + 1])
+        self.next_position = (
+            self.get_position(rows[size - 1]) if len(rows) > size else None)
+        return rows[:size]
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict((
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data),
+        )))
 
 
 class CustomPagination(PageNumberPagination):
+    """
+    Постраничная пагинация page/limit. По запросу с pagination=cursor
+    (или с уже полученным cursor) переключается на пагинацию по ключу:
+    без OFFSET и без подсчёта общего количества. Поля ключа берутся
+    из атрибута представления cursor_ordering. Выдача, отсортированная
+    по ordering или по релевантности поиска, как и готовые списки вместо
+    запросов, всегда постраничная.
+    """
     page_size = 6
     page_size_query_param = 'limit'
+    django_paginator_class = CachedCountPaginator
+    keyset_pagination_class = KeysetPagination
+    pagination_mode_query_param = 'pagination'
+    keyset = None
+
+    def use_keyset(self, request):
+        params = request.query_params
+        if params.get('ordering') or params.get('search'):
+            return False
+        return (
+            self.keyset_pagination_class.cursor_query_param in params
+            or params.get(self.pagination_mode_query_param) == 'cursor'
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not isinstance(queryset, QuerySet) or not self.use_keyset(
+                request):
+            return super().paginate_queryset(queryset, request, view)
+        self.keyset = self.keyset_pagination_class()
+        ordering = getattr(view, 'cursor_ordering', None)
+        if ordering:
+            self.keyset.ordering = ordering
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class FeedPagination(KeysetPagination):
+    """
+    Курсорная пагинация ленты, собранной из нескольких источников.
+    Вместо запроса получает функцию fetch(after, limit), которая
+    возвращает пары (дата публикации, id) после позиции after; курсор
+    хранит последнюю пару страницы.
+    """
+    def decode_cursor(self, request):
+        value = request.query_params.get(self.cursor_query_param)
+        if not value:
+            return None
+        try:
+            pub_date, pk = urlsafe_b64decode(
+                value.encode()).decode().split(' ')
+            pub_date = parse_datetime(pub_date)
+            if pub_date is None:
+                raise ValueError
+            return pub_date, int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        pub_date, pk = position
+        value = urlsafe_b64encode(f'{pub_date.isoformat()} {pk}'.encode())
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, value.decode())
+
+    def paginate_queryset(self, fetch, request, view=None):
+        self.base_url = remove_query_param(
+            request.build_absolute_uri(), self.cursor_query_param)
+        size = self.get_page_size(request)
+        rows = fetch(self.decode_cursor(request), size + 1)
+        self.next_position = rows[size - 1] if len(rows) > size else None
+        return [pk for _, pk in rows[:size]]
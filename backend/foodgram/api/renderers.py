@@ -0,0 +1,109 @@
+import csv
+import io
+import os
+from itertools import chain
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer
+
+SHOPPING_LIST_TITLE = 'Список покупок'
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Базовый рендерер списка покупок. Строки списка приходят итератором
+    кортежей (название, единица измерения, количество) и отдаются
+    потоком через stream(); render() нужен для ответов с ошибками.
+    """
+    charset = 'utf-8'
+    encoding = 'utf-8'
+
+    def stream(self, rows):
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            return str(data.get('detail', data)).encode(self.encoding)
+        return b''.join(self.stream(data))
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        yield f'{SHOPPING_LIST_TITLE}: '.encode(self.encoding)
+        for name, measurement_unit, amount in rows:
+            yield f'\n {name} ({measurement_unit}) — {amount}'.encode(
+                self.encoding)
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    header = ('Ингредиент', 'Единицы измерения', 'Количество')
+
+    def stream(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for values in chain([self.header], rows):
+            writer.writerow(values)
+            yield buffer.getvalue().encode(self.encoding)
+            buffer.seek(0)
+            buffer.truncate()
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    """
+    PDF собирается целиком в памяти: формат требует таблицу смещений
+    в конце файла, поэтому поток отдаётся уже готовыми кусками.
+    """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingListFont'
+    font_size = 12
+    margin = 50
+    chunk_size = 64 * 1024
+
+    def register_font(self):
+        # Во встроенных шрифтах PDF нет кириллицы: без TTF-шрифта
+        # вместо названий получились бы пустые квадраты.
+        font_path = settings.SHOPPING_LIST_PDF_FONT
+        if not os.path.exists(font_path):
+            raise ImproperlyConfigured(
+                f'Не найден шрифт для PDF: {font_path}. Укажите в '
+                f'SHOPPING_LIST_PDF_FONT TTF-шрифт с кириллицей.')
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(self.font_name, font_path))
+        return self.font_name
+
+    def stream(self, rows):
+        # Шрифт проверяется до начала ответа, а не при первом чтении
+        # потока, когда заголовки уже отправлены.
+        return self.render_pages(self.register_font(), rows)
+
+    def render_pages(self, font, rows):
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        width, height = A4
+        line_height = self.font_size * 1.5
+        pdf.setFont(font, self.font_size)
+        y = height - self.margin
+        pdf.drawString(self.margin, y, f'{SHOPPING_LIST_TITLE}:')
+        for name, measurement_unit, amount in rows:
+            y -= line_height
+            if y < self.margin:
+                pdf.showPage()
+                pdf.setFont(font, self.font_size)
+                y = height - self.margin
+            pdf.drawString(self.margin, y,
+                           f'{name} ({measurement_unit}) — {amount}')
+        pdf.save()
+        buffer.seek(0)
+        yield from iter(lambda: buffer.read(self.chunk_size), b'')
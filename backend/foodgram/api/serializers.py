@@ -1,11 +1,16 @@
-import base64
+from collections import Counter
 
 import django.contrib.auth.password_validation as validators
 import webcolors
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            RecipeTag, ShoppingCart, Subcribtion, Tag)
+from django.db import transaction
+from django.db.models import F, Prefetch, prefetch_related_objects
+from recipes.images import (ImageRejected, decode_base64_image, rendition_urls,
+                            schedule_renditions)
+from recipes.models import (Favorite, FeedEntry, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShoppingListItem,
+                            Subcribtion, Tag)
 from rest_framework import serializers, status
 from rest_framework.exceptions import ValidationError
 from rest_framework.fields import SerializerMethodField
@@ -29,9 +34,13 @@ class Hex2NameColor(serializers.Field):
 class Base64ImageField(serializers.ImageField):
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            try:
+                data = decode_base64_image(data)
+            except ImageRejected as error:
+                raise serializers.ValidationError(str(error))
+            # Формат и размеры уже проверены по заголовку, повторная
+            # проверка ImageField прочитала бы весь файл в память.
+            return serializers.FileField.to_internal_value(self, data)
         return super().to_internal_value(data)
 
 
@@ -85,6 +94,8 @@ class UserSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if self.context.get('request').user.is_anonymous:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return obj.following.filter(user=request.user).exists()
 
 
@@ -110,9 +121,7 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
     Сериализатор для вспомогательной модели, связывающей
     ингредиенты и рецепты.
     """
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField(source='ingredient_id')
     name = serializers.ReadOnlyField(source='ingredient.name')
     measurement_unit = serializers.ReadOnlyField(
         source='ingredient.measurement_unit'
@@ -131,14 +140,16 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         many=True,
         source='ingredientinrecipe')
     is_favorited = serializers.SerializerMethodField()
+    is_in_shopping_cart = serializers.SerializerMethodField()
 
     image = Base64ImageField(max_length=None)
+    images = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
-                  'name', 'image', 'text', 'cooking_time',
-                  'is_favorited')
+                  'name', 'image', 'images', 'text', 'cooking_time',
+                  'is_favorited', 'is_in_shopping_cart')
 
     def get_ingredients(self, obj):
         ingredients = RecipeIngredient.objects.filter(recipe=obj)
@@ -148,15 +159,68 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return obj.favorites.filter(user=request.user).exists()
 
+    def get_images(self, obj):
+        urls = rendition_urls(obj)
+        request = self.context.get('request')
+        if urls is None or request is None:
+            return urls
+        return {
+            rendition: request.build_absolute_uri(url)
+            for rendition, url in urls.items()
+        }
+
+    def get_is_in_shopping_cart(self, obj):
+        request = self.context.get('request')
+        if not request or request.user.is_anonymous:
+            return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return obj.in_shopping_cart.filter(user=request.user).exists()
+
+
+class PantryQuerySerializer(serializers.Serializer):
+    """Параметры поиска рецептов по имеющимся ингредиентам"""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.PANTRY_MAX_INGREDIENTS
+    )
+
+
+class PantryRecipeSerializer(RecipeReadSerializer):
+    """
+    Рецепт в выдаче поиска по имеющимся ингредиентам: доля ингредиентов,
+    которые уже есть, и список недостающих. Ингредиенты в context['pantry'].
+    """
+    coverage = serializers.SerializerMethodField()
+    missing_ingredients = serializers.SerializerMethodField()
+
+    class Meta(RecipeReadSerializer.Meta):
+        fields = RecipeReadSerializer.Meta.fields + (
+            'coverage', 'missing_ingredients')
+
+    def get_coverage(self, obj):
+        items = obj.ingredientinrecipe.all()
+        have = sum(item.ingredient_id in self.context['pantry']
+                   for item in items)
+        return round(have / len(items), 3) if items else 0
+
+    def get_missing_ingredients(self, obj):
+        return RecipeIngredientSerializer([
+            item for item in obj.ingredientinrecipe.all()
+            if item.ingredient_id not in self.context['pantry']
+        ], many=True).data
+
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
     """Сериализатор cоздания рецепта"""
     author = UserSerializer(read_only=True)
     image = Base64ImageField()
-    tags = serializers.PrimaryKeyRelatedField(many=True,
-                                              queryset=Tag.objects.all())
+    tags = serializers.ListField(child=serializers.IntegerField())
     ingredients = RecipeIngredientSerializer(many=True)
 
     class Meta:
@@ -164,6 +228,40 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                   'tags', 'cooking_time')
         model = Recipe
 
+    @staticmethod
+    def check_ids(model, ids, label):
+        """Ищет все объекты одним запросом и возвращает найденные вместе
+        со списком ошибок о повторах и отсутствующих id."""
+        found = model.objects.in_bulk(set(ids))
+        errors = []
+        duplicates = sorted(
+            pk for pk, count in Counter(ids).items() if count > 1)
+        if duplicates:
+            errors.append(
+                f'{label} повторяются: {", ".join(map(str, duplicates))}')
+        missing = sorted(set(ids) - found.keys())
+        if missing:
+            errors.append(
+                f'{label} не найдены: {", ".join(map(str, missing))}')
+        return found, errors
+
+    def validate(self, data):
+        errors = {}
+        if 'ingredients' in data:
+            _, errors['ingredients'] = self.check_ids(
+                Ingredient,
+                [item['ingredient_id'] for item in data['ingredients']],
+                'Ингредиенты'
+            )
+        if 'tags' in data:
+            found, errors['tags'] = self.check_ids(
+                Tag, data['tags'], 'Теги')
+            data['tags'] = [found[pk] for pk in data['tags'] if pk in found]
+        errors = {field: error for field, error in errors.items() if error}
+        if errors:
+            raise ValidationError(errors)
+        return data
+
     def get_ingredients(self, obj):
         ingredients = RecipeIngredient.objects.filter(recipe=obj)
         return RecipeIngredientSerializer(ingredients, many=True).data
@@ -172,12 +270,13 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     def create_ingredients(recipe, ingredients):
         RecipeIngredient.objects.bulk_create([
             RecipeIngredient(
-                ingredient=ingredient['id'],
+                ingredient_id=ingredient['ingredient_id'],
                 recipe=recipe,
                 amount=ingredient['amount']
             ) for ingredient in ingredients
         ])
 
+    @transaction.atomic
     def create(self, validated_data):
         request = self.context.get('request', None)
         tags = validated_data.pop('tags')
@@ -186,17 +285,73 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                                        **validated_data)
         recipe.tags.set(tags)
         self.create_ingredients(recipe, ingredients)
+        User.objects.filter(pk=request.user.pk).update(
+            recipes_count=F('recipes_count') + 1)
+        FeedEntry.objects.fan_out([recipe])
+        schedule_renditions(recipe)
         return recipe
 
+    @staticmethod
+    def update_ingredients(recipe, amounts):
+        """
+        Приводит ингредиенты рецепта к amounts вида {ingredient_id: amount},
+        меняя только отличающиеся строки. Возвращает прежние количества.
+        """
+        existing = {
+            item.ingredient_id: item
+            for item in RecipeIngredient.objects.filter(recipe=recipe)
+        }
+        removed = existing.keys() - amounts.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=recipe, ingredient_id=pk, amount=amount)
+            for pk, amount in amounts.items() if pk not in existing
+        ])
+        changed = [
+            item for pk, item in existing.items()
+            if pk in amounts and item.amount != amounts[pk]
+        ]
+        old_amounts = {pk: item.amount for pk, item in existing.items()}
+        for item in changed:
+            item.amount = amounts[item.ingredient_id]
+        RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        return old_amounts
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        RecipeIngredient.objects.filter(recipe=instance).delete()
-        RecipeTag.objects.filter(recipe=instance).delete()
-        instance.tags.set(validated_data.pop('tags'))
-        ingredients = validated_data.pop('ingredients')
-        self.create_ingredients(instance, ingredients)
-        return super().update(instance, validated_data)
+        # При частичном обновлении теги и ингредиенты могут не прийти.
+        tags = validated_data.pop('tags', None)
+        if tags is not None:
+            instance.tags.set(tags)
+        ingredients = validated_data.pop('ingredients', None)
+        if ingredients is not None:
+            amounts = {
+                ingredient['ingredient_id']: ingredient['amount']
+                for ingredient in ingredients
+            }
+            old_amounts = self.update_ingredients(instance, amounts)
+            ShoppingListItem.objects.change_recipe(
+                instance, old_amounts, amounts)
+        old_image = instance.image.name
+        instance = super().update(instance, validated_data)
+        if instance.image.name != old_image:
+            # Та же картинка, загруженная повторно, получает прежнее имя,
+            # и готовые копии остаются в силе.
+            instance.renditions_ready = False
+            Recipe.objects.filter(pk=instance.pk).update(
+                renditions_ready=False)
+            schedule_renditions(instance)
+        return instance
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance], 'tags',
+            Prefetch('ingredientinrecipe',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient'))
+        )
         return RecipeReadSerializer(instance, context={
             'request': self.context.get('request')
         }).data
@@ -224,6 +379,13 @@ class FavoriteSerializer(serializers.ModelSerializer):
             )
         return data
 
+    @transaction.atomic
+    def create(self, validated_data):
+        favorite = super().create(validated_data)
+        Recipe.objects.filter(pk=favorite.recipe_id).update(
+            favorites_count=F('favorites_count') + 1)
+        return favorite
+
     def to_representation(self, instance):
         request = self.context.get('request')
         return RecipeShortSerializer(
@@ -249,6 +411,11 @@ class SubscribeSerializer(serializers.ModelSerializer):
                 detail='Нельзя подписаться на самого себя',
                 code=status.HTTP_400_BAD_REQUEST,
             )
+        if user.follower.filter(author=author).exists():
+            raise ValidationError(
+                detail='Вы уже подписаны на этого автора',
+                code=status.HTTP_400_BAD_REQUEST,
+            )
         return data
 
 
@@ -258,18 +425,21 @@ class SubscribtionsSerializer(UserSerializer):
     recipes = SerializerMethodField()
 
     class Meta(UserSerializer.Meta):
-        fields = ('recipes_count', 'recipes', 'username')
+        fields = UserSerializer.Meta.fields + ('recipes', 'recipes_count')
         read_only_fields = ('username',)
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[: int(limit)]
+        if hasattr(obj, 'limited_recipes'):
+            recipes = obj.limited_recipes
+        else:
+            request = self.context.get('request')
+            limit = request.GET.get('recipes_limit')
+            recipes = obj.recipes.all()
+            if limit:
+                recipes = recipes[: int(limit)]
         serializer = RecipeShortSerializer(recipes, many=True, read_only=True)
         return serializer.data
 
@@ -288,6 +458,14 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
             )
         return data
 
+    @transaction.atomic
+    def create(self, validated_data):
+        cart = super().create(validated_data)
+        ShoppingListItem.objects.add_recipe(cart.user, cart.recipe)
+        Recipe.objects.filter(pk=cart.recipe_id).update(
+            in_carts_count=F('in_carts_count') + 1)
+        return cart
+
     def to_representation(self, instance):
         request = self.context.get('request')
         return RecipeShortSerializer(
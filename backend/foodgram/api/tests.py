@@ -0,0 +1,884 @@
+import csv
+import io
+import os
+import shutil
+import tempfile
+from base64 import b64encode
+from datetime import timedelta
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from recipes.cache import (PANTRY, clear_caches, get_version, state_cache,
+                           version_key)
+from recipes.images import ImageRejected, decode_base64_image
+from recipes.models import (Favorite, FeedEntry, Ingredient, Recipe,
+                            RecipeIngredient, RecipeTag, ShoppingCart,
+                            ShoppingListItem, Subcribtion, Tag)
+from recipes.storage import ContentAddressedStorage
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import User
+
+from . import metrics
+from .authentication import token_cache_key
+from .pagination import KeysetPagination
+
+
+def create_user(number):
+    return User.objects.create_user(
+        username=f'user{number}', email=f'user{number}@example.com',
+        first_name='Имя', last_name='Фамилия', password='password')
+
+
+def create_recipes(author, count, tags, ingredients):
+    """Рецепты со всеми тегами и ингредиентами из переданных."""
+    recipes = [
+        Recipe.objects.create(author=author, name=f'Рецепт {number}',
+                              text='Описание', cooking_time=10)
+        for number in range(count)
+    ]
+    RecipeTag.objects.bulk_create([
+        RecipeTag(recipe=recipe, tag=tag)
+        for recipe in recipes for tag in tags
+    ])
+    RecipeIngredient.objects.bulk_create([
+        RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=10)
+        for recipe in recipes for ingredient in ingredients
+    ])
+    User.objects.filter(pk=author.pk).update(
+        recipes_count=F('recipes_count') + count)
+    return recipes
+
+
+class QueryCountMixin:
+
+    def setUp(self):
+        clear_caches()
+
+    def count_queries(self, client, path, params, results=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        if results is not None:
+            self.assertEqual(len(response.data['results']), results)
+        return len(queries)
+
+
+class RecipeListQueriesTest(QueryCountMixin, TestCase):
+    """Число запросов к базе у списка рецептов не зависит от размера
+    страницы: счётчик, рецепты, теги, ингредиенты и, для
+    авторизованного пользователя, авторы с is_subscribed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(1)
+        author = create_user(2)
+        tags = [
+            Tag.objects.create(name=f'Тег {number}', color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(5)
+        ]
+        recipes = create_recipes(author, 60, tags, ingredients)
+        Favorite.objects.create(user=cls.user, recipe=recipes[0])
+        ShoppingCart.objects.create(user=cls.user, recipe=recipes[1])
+        Subcribtion.objects.create(user=cls.user, author=author)
+
+    def test_authenticated_list(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for limit in (6, 50):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.count_queries(
+                    client, '/api/recipes/', {'limit': limit}, limit), 5)
+
+    def test_anonymous_list(self):
+        for limit in (6, 50):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.count_queries(
+                    APIClient(), '/api/recipes/', {'limit': limit}, limit),
+                    4)
+
+
+class SubscriptionsQueriesTest(QueryCountMixin, TestCase):
+    """Подписки читаются за постоянное число запросов: счётчик, авторы
+    и их последние рецепты одним запросом с recipes_limit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(0)
+        User.objects.bulk_create([
+            User(username=f'author{number}',
+                 email=f'author{number}@example.com')
+            for number in range(100)
+        ])
+        cls.authors = list(User.objects.filter(
+            username__startswith='author'))
+        for author in cls.authors:
+            create_recipes(author, 3, [], [])
+
+    def subscribe(self, authors):
+        Subcribtion.objects.bulk_create([
+            Subcribtion(user=self.user, author=author) for author in authors
+        ])
+
+    def get_subscriptions(self, count):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/users/subscriptions/', {
+                'limit': 100, 'recipes_limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), count)
+        for author in response.data['results']:
+            self.assertTrue(author['is_subscribed'])
+            self.assertEqual(author['recipes_count'], 3)
+            self.assertEqual(len(author['recipes']), 2)
+        return len(queries)
+
+    def test_constant_queries(self):
+        self.subscribe(self.authors[:1])
+        one = self.get_subscriptions(1)
+        self.subscribe(self.authors[1:])
+        self.assertEqual(self.get_subscriptions(100), one)
+        self.assertEqual(one, 3)
+
+
+class CounterTest(TestCase):
+    """Счётчик, разошедшийся с данными, не уходит ниже нуля."""
+
+    def test_decrement_stops_at_zero(self):
+        user = create_user(1)
+        recipe = create_recipes(user, 1, [], [])[0]
+        # Связи созданы мимо API, поэтому счётчики остались нулевыми.
+        Favorite.objects.create(user=user, recipe=recipe)
+        ShoppingCart.objects.create(user=user, recipe=recipe)
+        User.objects.filter(pk=user.pk).update(recipes_count=0)
+        client = APIClient()
+        client.force_authenticate(user)
+        for action in ('favorite', 'shopping_cart'):
+            response = client.delete(f'/api/recipes/{recipe.pk}/{action}/')
+            self.assertEqual(response.status_code, 204)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertEqual(recipe.in_carts_count, 0)
+        response = client.delete(f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(response.status_code, 204)
+        user.refresh_from_db()
+        self.assertEqual(user.recipes_count, 0)
+
+
+class RecipeUpdateTest(TestCase):
+    """Обновление рецепта меняет только отличающиеся строки связей."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user(1)
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}', color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        cls.recipe = create_recipes(
+            cls.author, 1, cls.tags, cls.ingredients)[0]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def relations(self):
+        return (
+            set(RecipeTag.objects.filter(recipe=self.recipe).values_list(
+                'pk', 'tag_id')),
+            set(RecipeIngredient.objects.filter(
+                recipe=self.recipe).values_list(
+                    'pk', 'ingredient_id', 'amount')),
+        )
+
+    def test_one_amount_change_is_one_update(self):
+        before_tags, before_ingredients = self.relations()
+        amounts = {ingredient.pk: 10 for ingredient in self.ingredients}
+        amounts[self.ingredients[0].pk] = 20
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.pk}/', {
+                    'tags': [tag.pk for tag in self.tags],
+                    'ingredients': [
+                        {'id': pk, 'amount': amount}
+                        for pk, amount in amounts.items()
+                    ],
+                }, format='json')
+        self.assertEqual(response.status_code, 200)
+        writes = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+            and ('recipes_recipeingredient' in query['sql']
+                 or 'recipes_recipetag' in query['sql'])
+        ]
+        self.assertEqual(len(writes), 1, writes)
+        self.assertTrue(writes[0].startswith(
+            'UPDATE "recipes_recipeingredient"'))
+        tags, ingredients = self.relations()
+        self.assertEqual(tags, before_tags)
+        self.assertEqual(
+            {(pk, ingredient_id) for pk, ingredient_id, _ in ingredients},
+            {(pk, ingredient_id)
+             for pk, ingredient_id, _ in before_ingredients})
+        self.assertEqual(
+            {ingredient_id: amount for _, ingredient_id, amount
+             in ingredients}, amounts)
+
+    def test_partial_update_keeps_relations(self):
+        before = self.relations()
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/', {'name': 'Новое название'},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, 'Новое название')
+        self.assertEqual(self.relations(), before)
+
+
+class RecipeValidationTest(TestCase):
+    """Теги и ингредиенты проверяются одним запросом на справочник."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user(1)
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(20)
+        ]
+        cls.recipes = create_recipes(cls.author, 2, [cls.tag], [])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def patch(self, recipe, ingredients, tags):
+        return self.client.patch(f'/api/recipes/{recipe.pk}/', {
+            'tags': tags,
+            'ingredients': [{'id': pk, 'amount': 10} for pk in ingredients],
+        }, format='json')
+
+    def test_duplicates_and_missing_reported_together(self):
+        first = self.ingredients[0].pk
+        response = self.patch(
+            self.recipes[0], [first, first, 10 ** 6],
+            [self.tag.pk, self.tag.pk, 10 ** 6])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data['ingredients']), 2)
+        self.assertEqual(len(response.data['tags']), 2)
+        self.assertIn(str(first), response.data['ingredients'][0])
+        self.assertIn(str(10 ** 6), response.data['ingredients'][1])
+
+    def test_queries_do_not_grow_with_ingredients(self):
+        ids = [ingredient.pk for ingredient in self.ingredients]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch(self.recipes[0], ids[:2], [self.tag.pk])
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(len(queries)):
+            response = self.patch(self.recipes[1], ids, [self.tag.pk])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ingredients']), 20)
+
+
+@override_settings(REQUEST_METRICS_FLUSH_SECONDS=3600)
+class RequestMetricsTest(TestCase):
+    """Замеры копятся в процессе и попадают в кеш при чтении сводки."""
+
+    def setUp(self):
+        clear_caches()
+        metrics.reset()
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='password')
+
+    def tearDown(self):
+        metrics.reset()
+
+    def test_requests_are_buffered(self):
+        for _ in range(3):
+            response = APIClient().get('/api/tags/')
+            self.assertNotIn('Server-Timing', response)
+        self.assertIsNone(state_cache.get('metrics:TagViewSet.list:requests'))
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        summary = client.get('/api/metrics/').data
+        self.assertEqual(summary['TagViewSet.list']['requests'], 3)
+
+    def test_views_registered_once(self):
+        for view in ('first', 'second', 'first'):
+            metrics.register_view(view)
+        self.assertEqual(metrics.registered_views(), ['first', 'second'])
+        self.assertEqual(state_cache.get(metrics.VIEWS_KEY), 2)
+
+
+@override_settings(RECIPE_SEARCH_LIMIT=2)
+class RecipeSearchTest(TestCase):
+    """Ограничение выдачи поиска считается после остальных фильтров."""
+
+    def setUp(self):
+        clear_caches()
+
+    def test_limit_applies_after_filters(self):
+        author = create_user(1)
+        other = create_user(2)
+        # При равной релевантности выше рецепты с большим id.
+        recipe = create_recipes(author, 1, [], [])[0]
+        create_recipes(other, 3, [], [])
+        response = APIClient().get(
+            '/api/recipes/', {'search': 'рецепт', 'author': author.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [found['id'] for found in response.data['results']],
+            [recipe.pk])
+
+
+class TokenCacheTest(TestCase):
+    """Кеш токенов не выдаёт токен и не хранит счётчики пользователя."""
+
+    def setUp(self):
+        clear_caches()
+        self.user = create_user(1)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_key_is_hashed(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        cache_key = token_cache_key(self.token.key)
+        self.assertNotIn(self.token.key, cache_key)
+        self.assertIsNotNone(state_cache.get(cache_key))
+
+    def test_cached_user_does_not_keep_counters(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        follower = APIClient()
+        follower.force_authenticate(create_user(2))
+        response = follower.post(f'/api/users/{self.user.pk}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+        user = state_cache.get(token_cache_key(self.token.key)).user
+        self.assertEqual(user.followers_count, 1)
+        user = state_cache.get(token_cache_key(self.token.key)).user
+        user.first_name = 'Новое имя'
+        user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Новое имя')
+        self.assertEqual(self.user.followers_count, 1)
+
+
+class ReferenceCacheTest(TestCase):
+    """Ответы автодополнения копятся в вытесняемом кеше и не вытесняют
+    версии индексов."""
+
+    def setUp(self):
+        clear_caches()
+
+    def test_autocomplete_keeps_index_versions(self):
+        version = get_version(PANTRY)
+        client = APIClient()
+        # Больше, чем MAX_ENTRIES у LocMemCache по умолчанию.
+        for number in range(400):
+            response = client.get('/api/ingredients/', {'name': f'{number}'})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(state_cache.get(version_key(PANTRY)), version)
+
+
+class ShoppingListTest(TestCase):
+    """Список покупок меняется на разницу при правке и удалении рецепта
+    и всегда совпадает с пересчётом по корзинам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user(1)
+        cls.buyers = [create_user(2), create_user(3)]
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        cls.first, cls.second = create_recipes(
+            cls.author, 2, [cls.tag], cls.ingredients[:2])
+
+    def setUp(self):
+        clear_caches()
+        self.clients = {}
+        for user in [self.author] + self.buyers:
+            self.clients[user] = APIClient()
+            self.clients[user].force_authenticate(user)
+        for buyer in self.buyers:
+            for recipe in (self.first, self.second):
+                response = self.clients[buyer].post(
+                    f'/api/recipes/{recipe.pk}/shopping_cart/')
+                self.assertEqual(response.status_code, 201)
+
+    def shopping_lists(self):
+        return {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingListItem.objects.filter(amount__gt=0).values_list(
+                'user_id', 'ingredient_id', 'amount')
+        }
+
+    def assert_matches_carts(self):
+        self.assertEqual(self.shopping_lists(),
+                         ShoppingListItem.objects.compute())
+
+    def test_added_recipes_are_summed(self):
+        self.assertEqual(self.shopping_lists(), {
+            (buyer.pk, ingredient.pk): 20
+            for buyer in self.buyers for ingredient in self.ingredients[:2]
+        })
+        self.assert_matches_carts()
+
+    def test_patch_applies_difference(self):
+        first, second, third = self.ingredients
+        response = self.clients[self.author].patch(
+            f'/api/recipes/{self.first.pk}/', {'ingredients': [
+                {'id': first.pk, 'amount': 15},
+                {'id': third.pk, 'amount': 7},
+            ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        for buyer in self.buyers:
+            lists = self.shopping_lists()
+            self.assertEqual(lists[buyer.pk, first.pk], 25)
+            self.assertEqual(lists[buyer.pk, second.pk], 10)
+            self.assertEqual(lists[buyer.pk, third.pk], 7)
+        self.assert_matches_carts()
+
+    def test_delete_and_cart_removal_subtract_recipe(self):
+        response = self.clients[self.author].delete(
+            f'/api/recipes/{self.first.pk}/')
+        self.assertEqual(response.status_code, 204)
+        response = self.clients[self.buyers[0]].delete(
+            f'/api/recipes/{self.second.pk}/shopping_cart/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.shopping_lists(), {
+            (self.buyers[1].pk, ingredient.pk): 10
+            for ingredient in self.ingredients[:2]
+        })
+        self.assert_matches_carts()
+
+
+class ShoppingListDownloadTest(TestCase):
+    """Список покупок отдаётся в txt, csv и pdf и поддерживает условные
+    запросы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(1)
+        cls.ingredient = Ingredient.objects.create(
+            name='Картофель', measurement_unit='г')
+        cls.recipe = create_recipes(cls.user, 1, [], [cls.ingredient])[0]
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        self.assertEqual(response.status_code, 201)
+
+    def download(self, file_format, **headers):
+        return self.client.get('/api/recipes/download_shopping_cart/',
+                               {'format': file_format}, **headers)
+
+    def content(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_txt(self):
+        response = self.download('txt')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('Картофель (г) — 10',
+                      self.content(response).decode('utf-8'))
+
+    def test_csv(self):
+        response = self.download('csv')
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        rows = list(csv.reader(io.StringIO(
+            self.content(response).decode('utf-8'))))
+        self.assertEqual(rows[1:], [['Картофель', 'г', '10']])
+
+    def test_pdf(self):
+        response = self.download('pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        content = self.content(response)
+        self.assertTrue(content.startswith(b'%PDF'))
+        # Встроен TTF-шрифт с кириллицей.
+        self.assertIn(b'FontFile2', content)
+        self.assertIn(b'DejaVuSans', content)
+
+    @override_settings(SHOPPING_LIST_PDF_FONT='/nonexistent/font.ttf')
+    def test_pdf_without_font(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.download('pdf')
+
+    def test_not_modified(self):
+        etag = self.download('txt')['ETag']
+        response = self.download('txt', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(self.download('csv')['ETag'], etag)
+        self.client.delete(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        response = self.download('txt', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+def image_data_url(image_format='PNG', size=(10, 10)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, image_format)
+    return data_url(buffer.getvalue())
+
+
+def data_url(content):
+    return f'data:image/png;base64,{b64encode(content).decode()}'
+
+
+class ImageDecodingTest(TestCase):
+    """Проверки картинки, переданной в base64, до её распаковки."""
+
+    def assert_rejected(self, data, message):
+        with self.assertRaisesMessage(ImageRejected, message):
+            decode_base64_image(data)
+
+    def test_valid_image(self):
+        file = decode_base64_image(image_data_url(size=(30, 20)))
+        self.assertEqual(file.name, 'temp.png')
+        with Image.open(file) as image:
+            self.assertEqual(image.size, (30, 20))
+
+    def test_without_base64_marker(self):
+        self.assert_rejected('data:image/png,abc', 'в base64')
+
+    @override_settings(MAX_IMAGE_UPLOAD_SIZE=100)
+    def test_too_large_file(self):
+        self.assert_rejected(data_url(b'0' * 200), 'слишком большая')
+
+    def test_invalid_base64(self):
+        self.assert_rejected('data:image/png;base64,не base64!',
+                             'Некорректная строка base64')
+
+    def test_not_an_image(self):
+        self.assert_rejected(data_url(b'plain text'), 'не является картинкой')
+
+    def test_unsupported_format(self):
+        self.assert_rejected(image_data_url('BMP'), 'BMP не поддерживается')
+
+    @override_settings(MAX_IMAGE_PIXELS=100)
+    def test_too_many_pixels(self):
+        self.assert_rejected(image_data_url(size=(20, 20)),
+                             'Слишком большое разрешение')
+
+    def test_rejected_image_is_validation_error(self):
+        client = APIClient()
+        client.force_authenticate(create_user(1))
+        response = client.post('/api/recipes/', {
+            'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 10,
+            'tags': [], 'ingredients': [],
+            'image': image_data_url('BMP'),
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+
+class ImageStorageTest(TestCase):
+    """Одинаковые картинки хранятся одним файлом с именем по хешу."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(1)
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        cls.ingredient = Ingredient.objects.create(
+            name='Ингредиент', measurement_unit='г')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.media_root = media_root
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, image):
+        response = self.client.post('/api/recipes/', {
+            'name': 'Рецепт', 'text': 'Описание', 'cooking_time': 10,
+            'tags': [self.tag.pk],
+            'ingredients': [{'id': self.ingredient.pk, 'amount': 10}],
+            'image': image,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Recipe.objects.get(pk=response.data['id'])
+
+    def stored_files(self):
+        return [
+            os.path.join(directory, name)
+            for directory, _, names in os.walk(self.media_root)
+            for name in names
+        ]
+
+    def test_same_image_is_stored_once(self):
+        image = image_data_url()
+        first = self.create_recipe(image)
+        second = self.create_recipe(image)
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(len(self.stored_files()), 1)
+        other = self.create_recipe(image_data_url(size=(20, 20)))
+        self.assertNotEqual(other.image.name, first.image.name)
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_concurrent_save_returns_existing_name(self):
+        # Второй запрос проверил exists() до того, как первый записал
+        # файл: _save вызывается для уже существующего имени.
+        storage = ContentAddressedStorage()
+        content = ContentFile(b'content')
+        name = storage.hashed_name('recipes/image.png', content)
+        self.assertEqual(storage._save(name, content), name)
+        self.assertEqual(storage._save(name, ContentFile(b'content')), name)
+        self.assertEqual(self.stored_files(), [storage.path(name)])
+
+
+class PantryTest(TestCase):
+    """Поиск по имеющимся ингредиентам: сначала рецепты с наибольшей
+    долей имеющихся ингредиентов, при равной доле — с большим их
+    числом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user(1)
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(5)
+        ]
+        first, second, third, fourth, fifth = cls.ingredients
+        cls.recipes = {
+            name: create_recipes(author, 1, [], ingredients)[0]
+            for name, ingredients in (
+                ('two of two', [first, second]),
+                ('three of three', [first, second, third]),
+                ('one of two', [third, fourth]),
+                ('none', [fifth]),
+            )
+        }
+
+    def setUp(self):
+        clear_caches()
+
+    def search(self, ingredients):
+        response = APIClient().get('/api/recipes/pantry/', {
+            'ingredients': [ingredient.pk for ingredient in ingredients]})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_ranking(self):
+        data = self.search(self.ingredients[:3])
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(
+            [recipe['id'] for recipe in data['results']],
+            [self.recipes[name].pk
+             for name in ('three of three', 'two of two', 'one of two')])
+        self.assertEqual(
+            [recipe['coverage'] for recipe in data['results']],
+            [1, 1, 0.5])
+        self.assertEqual(
+            [item['id'] for item in data['results'][2][
+                'missing_ingredients']],
+            [self.ingredients[3].pk])
+
+    def test_pagination(self):
+        response = APIClient().get('/api/recipes/pantry/', {
+            'ingredients': [ingredient.pk for ingredient in self.ingredients],
+            'limit': 2, 'page': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_requires_ingredients(self):
+        response = APIClient().get('/api/recipes/pantry/')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(FEED_FANOUT_MAX_FOLLOWERS=1)
+class FeedTest(TestCase):
+    """Лента подписок: рецепты обычных авторов рассылаются по лентам
+    подписчиков, рецепты популярных подмешиваются при чтении; выдача
+    идёт от новых к старым без повторов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user(1)
+        cls.author = create_user(2)
+        cls.popular = create_user(3)
+        cls.follower = create_user(4)
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def create_recipe(self, author, hours_ago):
+        recipe = create_recipes(author, 1, [], [])[0]
+        recipe.pub_date = self.now - timedelta(hours=hours_ago)
+        Recipe.objects.filter(pk=recipe.pk).update(pub_date=recipe.pub_date)
+        return recipe
+
+    def subscribe(self, client, author):
+        response = client.post(f'/api/users/{author.pk}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+
+    def read_feed(self):
+        ids = []
+        response = self.client.get('/api/recipes/feed/', {'limit': 2})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_feed(self):
+        # Рецепты до подписки попадают в ленту при подписке; у двух
+        # рецептов одна дата публикации.
+        self.create_recipe(self.author, 5)
+        self.create_recipe(self.author, 3)
+        self.create_recipe(self.popular, 4)
+        self.create_recipe(self.popular, 3)
+        self.subscribe(self.client, self.author)
+        self.subscribe(self.client, self.popular)
+        follower = APIClient()
+        follower.force_authenticate(self.follower)
+        self.subscribe(follower, self.popular)
+        # Новый рецепт обычного автора рассылается по лентам,
+        # популярного — нет.
+        fresh = self.create_recipe(self.author, 1)
+        FeedEntry.objects.fan_out([fresh])
+        popular_fresh = self.create_recipe(self.popular, 2)
+        FeedEntry.objects.fan_out([popular_fresh])
+        self.assertTrue(FeedEntry.objects.filter(
+            user=self.reader, recipe=fresh).exists())
+        self.assertFalse(FeedEntry.objects.filter(
+            recipe=popular_fresh).exists())
+        expected = list(Recipe.objects.filter(
+            author__in=(self.author, self.popular)
+        ).order_by('-pub_date', '-id').values_list('id', flat=True))
+        self.assertEqual(len(expected), 6)
+        self.assertEqual(self.read_feed(), expected)
+        response = self.client.delete(
+            f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.read_feed(), list(Recipe.objects.filter(
+            author=self.popular).order_by('-pub_date', '-id').values_list(
+                'id', flat=True)))
+
+
+class SimilarRecipesTest(TestCase):
+    """Похожие рецепты по общему избранному, после полного и
+    инкрементального расчёта."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user(number) for number in range(3)]
+        cls.recipes = create_recipes(cls.users[0], 4, [], [])
+        first, second, third, fourth = cls.recipes
+        for user, recipes in (
+            (cls.users[0], (first, second, third)),
+            (cls.users[1], (first, second)),
+            (cls.users[2], (fourth,)),
+        ):
+            Favorite.objects.bulk_create(
+                Favorite(user=user, recipe=recipe) for recipe in recipes)
+
+    def similar(self, recipe):
+        response = APIClient().get(f'/api/recipes/{recipe.pk}/similar/')
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data]
+
+    def test_similar(self):
+        first, second, third, fourth = self.recipes
+        call_command('build_recipe_similarity', stdout=io.StringIO())
+        self.assertEqual(self.similar(first), [second.pk, third.pk])
+        self.assertEqual(self.similar(fourth), [])
+        # Новое избранное учитывается инкрементальным расчётом; при
+        # равном сходстве первым идёт рецепт с большим id.
+        Favorite.objects.create(user=self.users[2], recipe=first)
+        call_command('build_recipe_similarity', '--incremental',
+                     stdout=io.StringIO())
+        self.assertEqual(self.similar(first),
+                         [second.pk, fourth.pk, third.pk])
+        self.assertEqual(self.similar(fourth), [first.pk])
+
+    def test_unknown_recipe(self):
+        response = APIClient().get('/api/recipes/0/similar/')
+        self.assertEqual(response.status_code, 404)
+
+
+class KeysetPaginationTest(TestCase):
+    """Пагинация по ключу не теряет и не повторяет рецепты с одинаковой
+    датой публикации и ограничивает размер страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user(1)
+        recipes = create_recipes(cls.author, 5, [], [])
+        pub_date = timezone.now()
+        Recipe.objects.filter(pk__in=[
+            recipe.pk for recipe in recipes[1:4]]).update(pub_date=pub_date)
+
+    def read_pages(self, url, params):
+        ids = []
+        response = APIClient().get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            if not response.data['next']:
+                return ids
+            response = APIClient().get(response.data['next'])
+
+    def test_recipes(self):
+        self.assertEqual(
+            self.read_pages('/api/recipes/',
+                            {'pagination': 'cursor', 'limit': 2}),
+            list(Recipe.objects.order_by('-pub_date', '-id').values_list(
+                'id', flat=True)))
+
+    def test_users(self):
+        for number in range(2, 6):
+            create_user(number)
+        self.assertEqual(
+            self.read_pages('/api/users/',
+                            {'pagination': 'cursor', 'limit': 2}),
+            list(User.objects.order_by('id').values_list('id', flat=True)))
+
+    @mock.patch.object(KeysetPagination, 'max_page_size', 3)
+    def test_page_size_is_capped(self):
+        response = APIClient().get(
+            '/api/recipes/', {'pagination': 'cursor', 'limit': 100_000})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_invalid_cursor(self):
+        for cursor in ('!', b64encode(b'[1]').decode(),
+                       b64encode(b'["x", 1]').decode()):
+            response = APIClient().get('/api/recipes/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
@@ -1,4 +1,5 @@
-from api.views import IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet
+from api.views import (IngredientViewSet, RecipeViewSet, RequestMetricsView,
+                       TagViewSet, UserViewSet)
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
@@ -12,7 +13,8 @@ router.register('ingredients', IngredientViewSet)
 router.register('users', UserViewSet)
 
 urlpatterns = [
-    path('', include('djoser.urls')),
+    path('metrics/', RequestMetricsView.as_view(), name='metrics'),
     path('', include(router.urls)),
+    path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
 ]
@@ -1,18 +1,37 @@
+from functools import partial
+from hashlib import md5
+
 from api.permissions import IsAdminOrAuthorOrReadOnly, IsAdminOrReadOnly
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import (BooleanField, Count, Exists, F, Max, OuterRef,
+                              Prefetch, Subquery, Value)
+from django.db.models.functions import Greatest
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Subcribtion, Tag)
+from recipes.cache import INGREDIENTS, TAGS, get_version
+from recipes.models import (Favorite, FeedEntry, Ingredient, Recipe,
+                            RecipeIngredient, RecipeSimilarity, ShoppingCart,
+                            ShoppingListItem, Subcribtion, Tag)
+from recipes.pantry import pantry_index
+from recipes.search import order_by_ids
 from rest_framework import mixins, permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from users.models import User
 
+from . import metrics
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import CustomPagination
+from .pagination import CustomPagination, FeedPagination
+from .renderers import (ShoppingListCSVRenderer, ShoppingListPDFRenderer,
+                        ShoppingListTextRenderer)
 from .serializers import (FavoriteSerializer, IngredientSerializer,
+                          PantryQuerySerializer, PantryRecipeSerializer,
                           RecipeCreateSerializer, RecipeReadSerializer,
                           RegisterUserSerializer, ShoppingCartSerializer,
                           SubscribeSerializer, SubscribtionsSerializer,
@@ -25,17 +44,57 @@ class CreateListRetrieveSet(mixins.CreateModelMixin, mixins.ListModelMixin,
     pass
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class VersionedCacheMixin:
+    """
+    Кеширует ответы справочников, которые меняются только через админку.
+    Ключ кеша и ETag включают версию справочника, которую сбрасывают
+    сигналы при изменении записей, поэтому устаревшие ответы никогда
+    не отдаются, а клиент может перепроверить данные и получить 304.
+    """
+    cache_version_name = None
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        version = get_version(self.cache_version_name)
+        path = request.get_full_path()
+        renderer_format = request.accepted_renderer.format
+        etag = quote_etag(md5(
+            f'{version}:{renderer_format}:{path}'.encode()).hexdigest())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            key = f'api:{self.cache_version_name}:{etag}'
+            data = cache.get(key)
+            if data is None:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, response.data,
+                          settings.REFERENCE_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args,
+                                    **kwargs)
+
+
+class TagViewSet(VersionedCacheMixin, viewsets.ReadOnlyModelViewSet):
+    cache_version_name = TAGS
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (IsAdminOrReadOnly, )
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(VersionedCacheMixin, viewsets.ReadOnlyModelViewSet):
+    cache_version_name = INGREDIENTS
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (IsAdminOrReadOnly, )
-    search_fields = ('^name', )
     pagination_class = None
     filter_backends = (IngredientFilter, )
 
@@ -48,11 +107,43 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filterset_class = RecipeFilter
     pagination_class = CustomPagination
 
+    def get_queryset(self):
+        user = self.request.user
+        queryset = Recipe.objects.prefetch_related(
+            'tags',
+            Prefetch('ingredientinrecipe',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient')),
+        )
+        if user.is_anonymous:
+            return queryset.select_related('author').annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return queryset.prefetch_related(
+            Prefetch('author', queryset=User.objects.annotate(
+                is_subscribed=Exists(Subcribtion.objects.filter(
+                    user=user, author=OuterRef('pk')))))
+        ).annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        )
+
     def get_serializer_class(self):
-        if self.action == 'get':
+        if self.request.method in permissions.SAFE_METHODS:
             return RecipeReadSerializer
         return RecipeCreateSerializer
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        ShoppingListItem.objects.change_recipe(
+            instance, ShoppingListItem.objects.recipe_amounts(instance), {})
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=Greatest(F('recipes_count') - 1, 0))
+        instance.delete()
+
     @action(detail=True, methods=('post',),
             permission_classes=[permissions.IsAuthenticated])
     def favorite(self, request, pk):
@@ -67,9 +158,12 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @favorite.mapping.delete
+    @transaction.atomic
     def delete_favorite(self, request, pk):
         recipe = get_object_or_404(Recipe, pk=pk)
         get_object_or_404(Favorite, user=request.user, recipe=recipe).delete()
+        Recipe.objects.filter(pk=pk).update(
+            favorites_count=Greatest(F('favorites_count') - 1, 0))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=('post',),
@@ -85,31 +179,94 @@ class RecipeViewSet(viewsets.ModelViewSet):
         serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, permission_classes=[permissions.IsAuthenticated],
+            pagination_class=FeedPagination)
+    def feed(self, request):
+        """Новые рецепты авторов, на которых подписан пользователь,
+        от новых к старым, с курсорной пагинацией."""
+        page = self.paginate_queryset(
+            partial(FeedEntry.objects.page, request.user))
+        serializer = RecipeReadSerializer(
+            order_by_ids(self.get_queryset(), page), many=True,
+            context={'request': request}
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False)
+    def pantry(self, request):
+        """Рецепты, для которых больше всего ингредиентов уже есть:
+        ?ingredients=1&ingredients=2. Ранжирование — по индексу в памяти,
+        из базы читается только текущая страница."""
+        query = PantryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        pantry = set(query.validated_data['ingredients'])
+        pantry_index.ensure_fresh()
+        page = self.paginate_queryset(pantry_index.search(pantry))
+        serializer = PantryRecipeSerializer(
+            order_by_ids(self.get_queryset(), page), many=True,
+            context={'request': request, 'pantry': pantry}
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True)
+    def similar(self, request, pk):
+        """Похожие рецепты из таблицы, которую заполняет команда
+        build_recipe_similarity, от самых похожих."""
+        ids = list(RecipeSimilarity.objects.filter(recipe_id=pk).order_by(
+            '-score', '-similar_id').values_list('similar_id', flat=True))
+        if not ids:
+            get_object_or_404(Recipe, pk=pk)
+        serializer = RecipeReadSerializer(
+            order_by_ids(self.get_queryset(), ids), many=True,
+            context={'request': request}
+        )
+        return Response(serializer.data)
+
     @action(detail=False,
-            permission_classes=[permissions.IsAuthenticated])
+            permission_classes=[permissions.IsAuthenticated],
+            renderer_classes=(ShoppingListTextRenderer,
+                              ShoppingListCSVRenderer,
+                              ShoppingListPDFRenderer))
     def download_shopping_cart(self, request):
-        shopping_list = {}
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__in_shopping_cart__user=request.user).order_by(
-            'ingredient__name').values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-        shopping_list = 'Список покупок: '
-        for ingredient in ingredients:
-            shopping_list += (
-                f'\n {ingredient["ingredient__name"]} '
-                f'({ingredient["ingredient__measurement_unit"]}) — '
-                f'{ingredient["amount"]}')
-        file = 'shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename="{file}.txt"'
+        items = request.user.shopping_list.filter(amount__gt=0)
+        state = request.user.shopping_list.aggregate(
+            count=Count('id'), last_modified=Max('updated'))
+        renderer = request.accepted_renderer
+        etag = quote_etag(md5(
+            f'{renderer.format}:{state["count"]}:{state["last_modified"]}'
+            .encode()).hexdigest())
+        last_modified = state['last_modified'] and int(
+            state['last_modified'].timestamp())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            ingredients = items.order_by('ingredient__name').values_list(
+                'ingredient__name', 'ingredient__measurement_unit', 'amount'
+            ).iterator()
+            response = StreamingHttpResponse(
+                renderer.stream(ingredients),
+                content_type=renderer.media_type
+                + (f'; charset={renderer.charset}' if renderer.charset
+                   else '')
+            )
+            file = f'shopping_list.{renderer.format}'
+            response['Content-Disposition'] = (
+                f'attachment; filename="{file}"')
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
         return response
 
     @shopping_cart.mapping.delete
+    @transaction.atomic
     def delete_shopping_cart(self, request, pk):
         recipe = get_object_or_404(Recipe, pk=pk)
         get_object_or_404(
             ShoppingCart, user=request.user, recipe=recipe).delete()
+        ShoppingListItem.objects.remove_recipe(request.user, recipe)
+        Recipe.objects.filter(pk=pk).update(
+            in_carts_count=Greatest(F('in_carts_count') - 1, 0))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -118,13 +275,15 @@ class UserViewSet(CreateListRetrieveSet):
     permission_classes = [permissions.AllowAny]
     serializer_class = UserSerializer
     pagination_class = CustomPagination
+    cursor_ordering = ('id',)
+    lookup_value_regex = r'\d+'
 
     def get_serializer_class(self):
         if self.action == 'create':
             return RegisterUserSerializer
         return UserSerializer
 
-    @action(detail=False,
+    @action(detail=True,
             permission_classes=[permissions.IsAuthenticated],
             methods=['post'])
     def subscribe(self, request, pk):
@@ -138,21 +297,58 @@ class UserViewSet(CreateListRetrieveSet):
         )
         serializer.is_valid(raise_exception=True)
         author = get_object_or_404(User, pk=pk)
-        Subcribtion.objects.create(user=user, author=author)
+        with transaction.atomic():
+            Subcribtion.objects.create(user=user, author=author)
+            User.objects.filter(pk=author.pk).update(
+                followers_count=F('followers_count') + 1)
+            FeedEntry.objects.follow(user, author)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @subscribe.mapping.delete
+    @transaction.atomic
     def unsubscribe(self, request, pk):
         author = get_object_or_404(User, pk=pk)
         get_object_or_404(Subcribtion, user=request.user,
                           author=author).delete()
+        User.objects.filter(pk=author.pk).update(
+            followers_count=Greatest(F('followers_count') - 1, 0))
+        FeedEntry.objects.unfollow(request.user, author)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(detail=False, permission_classes=[permissions.IsAuthenticated])
+    @action(detail=False, permission_classes=[permissions.IsAuthenticated],
+            cursor_ordering=('-subscription_id',))
     def subscriptions(self, request):
-        queryset = User.objects.filter(following__user=request.user)
+        recipes = Recipe.objects.all()
+        limit = request.query_params.get('recipes_limit', '')
+        if limit.isdigit():
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).values('pk')[:int(limit)]
+            ))
+        queryset = User.objects.filter(
+            following__user=request.user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+            subscription_id=F('following__id'),
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        )
         pages = self.paginate_queryset(queryset)
         serializer = SubscribtionsSerializer(
             pages, many=True, context={'request': request}
         )
         return self.get_paginated_response(serializer.data)
+
+
+class RequestMetricsView(APIView):
+    """Сводка замеров RequestMetricsMiddleware по представлениям:
+    GET — гистограммы и перцентили, DELETE — сброс."""
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return Response(metrics.summary())
+
+    def delete(self, request):
+        metrics.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -53,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -110,6 +111,65 @@ DATABASES = {
     }
 }
 
+# default — вытесняемые данные: ответы справочников и число записей
+# для пагинации. state — версии индексов, журналы изменений, метрики
+# и токены: записи без срока жизни, которые нельзя вытеснять ответами
+# API. Для нескольких процессов state должен быть общим кешем без
+# вытеснения (Redis с noeviction, Memcached с достаточной памятью),
+# иначе каждый процесс видит только свои метрики и токены.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            default='foodgram'),
+    },
+    'state': {
+        'BACKEND': os.getenv(
+            'STATE_CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv(
+            'STATE_CACHE_LOCATION',
+            default='foodgram-state'),
+    },
+}
+if CACHES['state']['BACKEND'].endswith('.LocMemCache'):
+    # LocMemCache вытесняет записи только при переполнении.
+    CACHES['state']['OPTIONS'] = {'MAX_ENTRIES': int(os.getenv(
+        'STATE_CACHE_MAX_ENTRIES', default=1_000_000))}
+
+PAGINATION_COUNT_CACHE_TIMEOUT = int(os.getenv(
+    'PAGINATION_COUNT_CACHE_TIMEOUT', default=0))
+
+REFERENCE_CACHE_TIMEOUT = int(os.getenv(
+    'REFERENCE_CACHE_TIMEOUT', default=60 * 60 * 24))
+
+# Сколько секунд токен и пользователь хранятся в кеше аутентификации.
+# Записи лежат в кеше state: если он у каждого процесса свой (LocMemCache),
+# выход, смена пароля или блокировка в одном процессе доходят
+# до остальных только через это время.
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv(
+    'AUTH_TOKEN_CACHE_TIMEOUT', default=60))
+
+REQUEST_METRICS_ENABLED = os.getenv(
+    'REQUEST_METRICS_ENABLED', default='true').lower() == 'true'
+
+# Счётчики копятся в процессе и сбрасываются в общий кеш не чаще,
+# чем раз в столько секунд.
+REQUEST_METRICS_FLUSH_SECONDS = int(os.getenv(
+    'REQUEST_METRICS_FLUSH_SECONDS', default=10))
+
+SERVER_TIMING_HEADER = os.getenv(
+    'SERVER_TIMING_HEADER', default='false').lower() == 'true'
+
+REQUEST_METRICS_SLOW_MS = int(os.getenv(
+    'REQUEST_METRICS_SLOW_MS', default=500))
+
+REQUEST_METRICS_MAX_QUERIES = int(os.getenv(
+    'REQUEST_METRICS_MAX_QUERIES', default=20))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -130,7 +190,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 }
 
@@ -153,6 +213,54 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+MAX_IMAGE_UPLOAD_SIZE = int(os.getenv(
+    'MAX_IMAGE_UPLOAD_SIZE', default=10 * 1024 * 1024))
+
+MAX_IMAGE_PIXELS = int(os.getenv(
+    'MAX_IMAGE_PIXELS', default=40_000_000))
+
+IMAGE_SPOOL_MAX_SIZE = 1024 * 1024
+
+IMAGE_PROCESSING_WORKERS = int(os.getenv(
+    'IMAGE_PROCESSING_WORKERS', default=2))
+
+IMAGE_RENDITIONS = {
+    'thumbnail': 160,
+    'card': 480,
+    'full': 1280,
+}
+
+IMAGE_RENDITION_QUALITY = 80
+
+INGREDIENT_SEARCH_LIMIT = 20
+
+# Сколько самых релевантных рецептов отдаёт поиск без PostgreSQL и среди
+# скольких лучших совпадений ищет рецепты, подходящие под остальные
+# фильтры.
+RECIPE_SEARCH_LIMIT = 500
+RECIPE_SEARCH_CANDIDATES = 10_000
+
+# Сколько изменений рецептов индекс продуктов применяет точечно;
+# при большем отставании он перестраивается целиком.
+PANTRY_INDEX_MAX_CHANGES = 1000
+PANTRY_MAX_INGREDIENTS = 50
+
+# Рецепты авторов с большим числом подписчиков не копируются в ленты,
+# а читаются из таблицы рецептов при запросе ленты.
+FEED_FANOUT_MAX_FOLLOWERS = int(os.getenv(
+    'FEED_FANOUT_MAX_FOLLOWERS', default=1000))
+# За сколько дней рецепты автора попадают в ленту при подписке.
+FEED_BACKFILL_DAYS = 30
+
+# Сколько соседей хранится для каждого рецепта.
+SIMILAR_RECIPES_COUNT = 20
+
+# TTF-шрифт с кириллицей для списка покупок в PDF; в образ его ставит
+# пакет fonts-dejavu-core.
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'
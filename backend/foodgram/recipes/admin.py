@@ -17,7 +17,7 @@ class TagInline(admin.TabularInline):
 
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author',)
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count',)
     list_filter = ('author', 'name', 'tags',)
     inlines = [
         IngredientInline,
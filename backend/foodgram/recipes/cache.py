@@ -0,0 +1,93 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+
+INGREDIENTS = 'ingredients'
+PANTRY = 'pantry'
+RECIPES = 'recipes'
+TAGS = 'tags'
+# Записи журнала изменений должны жить дольше, чем процесс может
+# не обращаться к своему индексу.
+CHANGE_LOG_TIMEOUT = 24 * 60 * 60
+
+
+class CacheProxy:
+    """Кеш с заданным именем для текущего потока, как
+    django.core.cache.cache для default."""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __getattr__(self, name):
+        return getattr(caches[self.alias], name)
+
+
+# Служебные записи, которые не должны вытесняться ответами API.
+state_cache = CacheProxy('state')
+
+
+def clear_caches():
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+def version_key(name):
+    return f'recipes:version:{name}'
+
+
+def get_version(name):
+    """Текущая версия справочника. Если её нет в кеше (например, кеш
+    очищен), выдаётся новая, чтобы локальные копии данных обновились."""
+    key = version_key(name)
+    version = state_cache.get(key)
+    if version is None:
+        state_cache.add(key, uuid4().hex, timeout=None)
+        version = state_cache.get(key)
+    return version
+
+
+def bump_version(name):
+    version = uuid4().hex
+    state_cache.set(version_key(name), version, timeout=None)
+    return version
+
+
+def changes_key(name, epoch):
+    return f'recipes:changes:{name}:{epoch}'
+
+
+def log_change(name, key):
+    """
+    Дописывает key в журнал изменений справочника, чтобы процессы
+    с локальными индексами применили только изменившиеся записи.
+    Журнал привязан к текущей версии: после bump_version или очистки
+    кеша он начинается заново, а индексы перестраиваются целиком.
+    """
+    counter = changes_key(name, get_version(name))
+    try:
+        number = state_cache.incr(counter)
+    except ValueError:
+        state_cache.add(counter, 0, timeout=None)
+        number = state_cache.incr(counter)
+    state_cache.set(f'{counter}:{number}', key, CHANGE_LOG_TIMEOUT)
+
+
+def read_changes(name, epoch, number, limit):
+    """
+    Возвращает текущие (версию, номер) журнала и ключи, изменённые после
+    записи number версии epoch. Вместо ключей возвращает None, если
+    версия сменилась, изменений больше limit или часть журнала уже
+    вытеснена из кеша, — тогда индекс нужно перестроить целиком.
+    """
+    current_epoch = get_version(name)
+    counter = changes_key(name, current_epoch)
+    current = state_cache.get(counter, 0)
+    if current_epoch != epoch or not number <= current <= number + limit:
+        return current_epoch, current, None
+    entries = state_cache.get_many([
+        f'{counter}:{position}' for position in range(number + 1, current + 1)
+    ])
+    if len(entries) != current - number:
+        return current_epoch, current, None
+    return current_epoch, current, list(entries.values())
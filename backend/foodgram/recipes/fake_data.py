@@ -0,0 +1,250 @@
+import io
+import math
+import random
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .bulk import copy_rows, insert_rows, next_pk, reset_sequences
+from .cache import PANTRY, RECIPES, bump_version
+from .models import (Favorite, FeedEntry, Ingredient, Recipe, RecipeIngredient,
+                     RecipeTag, ShoppingCart, ShoppingListItem, Subcribtion,
+                     Tag)
+
+User = get_user_model()
+
+FAKE_PASSWORD = 'fake-password'
+UNITS = ('г', 'мл', 'шт', 'ст. л.', 'ч. л.', 'по вкусу')
+HISTORY_DAYS = 365
+FAVORITES_DAYS = 30
+REBUILD_USERS_CHUNK = 1000
+# Словари для названий и описаний, чтобы поиск по рецептам работал
+# на данных с реалистичной частотой слов.
+DISHES = ('суп', 'салат', 'пирог', 'рагу', 'каша', 'запеканка', 'омлет',
+          'плов', 'паста', 'котлеты', 'блины', 'оладьи', 'борщ', 'соус',
+          'торт', 'печенье', 'жаркое', 'гуляш', 'ризотто', 'смузи')
+STYLES = ('домашний', 'быстрый', 'летний', 'постный', 'праздничный',
+          'острый', 'сливочный', 'бабушкин', 'лёгкий', 'печёный')
+TEXT_WORDS = ('нарезать', 'обжарить', 'добавить', 'перемешать', 'варить',
+              'запекать', 'посолить', 'поперчить', 'остудить', 'подавать',
+              'минут', 'на', 'в', 'до', 'готовности', 'сковороде',
+              'кастрюле', 'духовке', 'огне', 'среднем', 'кубиками',
+              'соломкой', 'зеленью', 'горячим', 'холодным', 'маслом',
+              'тесто', 'начинку', 'крышкой', 'слегка')
+
+
+class Popularity:
+    """
+    Распределение Ципфа по случайной перестановке ключей: вес k-го по
+    популярности равен 1 / k ** skew. При skew = 0 выбор равномерный.
+    """
+
+    def __init__(self, keys, skew, rng):
+        self.keys = list(keys)
+        rng.shuffle(self.keys)
+        self.cum_weights = list(accumulate(
+            1 / rank ** skew for rank in range(1, len(self.keys) + 1)))
+        self.rng = rng
+
+    def pick(self):
+        return self.rng.choices(self.keys, cum_weights=self.cum_weights)[0]
+
+    def pick_many(self, count):
+        """Несколько разных ключей; популярные попадают чаще."""
+        count = min(count, len(self.keys))
+        picked = set()
+        attempts = 0
+        while len(picked) < count and attempts < 5:
+            picked.update(self.rng.choices(
+                self.keys, cum_weights=self.cum_weights,
+                k=count - len(picked)))
+            attempts += 1
+        return sorted(picked)
+
+
+class FakeDataGenerator:
+    """
+    Заполняет базу синтетическими пользователями, рецептами, избранным,
+    корзинами и подписками. При одинаковом seed данные одинаковы.
+
+    Популярность авторов, рецептов и ингредиентов распределена по Ципфу
+    с показателем skew, а активность пользователей — логнормально:
+    немного «активных» пользователей дают заметную долю избранного,
+    корзин и подписок. Первичные ключи назначаются заранее, чтобы связи
+    можно было строить без чтения вставленных строк. Строки пишутся
+    мимо ORM: на PostgreSQL через COPY, на остальных базах через
+    executemany.
+    """
+
+    def __init__(self, seed=0, skew=1.0, batch_size=5000, use_copy=True,
+                 log=None):
+        self.seed = seed
+        self.skew = skew
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.use_copy = use_copy and connection.vendor == 'postgresql'
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+
+    def insert(self, model, fields, rows):
+        """Вставляет кортежи значений полей fields пачками по
+        batch_size, каждую в своей транзакции."""
+        total = 0
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            with transaction.atomic():
+                if self.use_copy:
+                    copy_rows(model, fields, batch)
+                else:
+                    insert_rows(model, fields, batch)
+            total += len(batch)
+        self.log(f'{model._meta.verbose_name_plural}: {total}')
+        return total
+
+    def activity(self, mean):
+        """Сколько связей создать пользователю: логнормальное
+        распределение со средним mean и длинным хвостом."""
+        if not mean:
+            return 0
+        if not self.skew:
+            return self.random.randint(0, 2 * mean)
+        sigma = 1.0
+        return int(self.random.lognormvariate(
+            math.log(mean) - sigma ** 2 / 2, sigma))
+
+    def moment(self, days):
+        return self.now - timedelta(seconds=self.random.uniform(
+            0, days * 24 * 3600))
+
+    def create_users(self, count):
+        start = next_pk(User)
+        password = make_password(FAKE_PASSWORD)
+        self.insert(User, (
+            'id', 'username', 'email', 'first_name', 'last_name',
+            'password', 'date_joined'
+        ), (
+            (pk, f'fake{self.seed}_{pk}', f'fake{self.seed}_{pk}@example.com',
+             'Тест', f'Пользователь {pk}', password,
+             self.moment(HISTORY_DAYS))
+            for pk in range(start, start + count)
+        ))
+        return range(start, start + count)
+
+    def create_tags(self, count):
+        start = next_pk(Tag)
+        self.insert(Tag, ('id', 'name', 'slug', 'color'), (
+            (pk, f'Тег {self.seed}-{pk}', f'fake{self.seed}-{pk}',
+             f'#{pk:06x}')
+            for pk in range(start, start + count)
+        ))
+        return range(start, start + count)
+
+    def create_ingredients(self, count):
+        start = next_pk(Ingredient)
+        self.insert(Ingredient, ('id', 'name', 'measurement_unit'), (
+            (pk, f'ингредиент {self.seed}-{pk}', self.random.choice(UNITS))
+            for pk in range(start, start + count)
+        ))
+        return range(start, start + count)
+
+    def create_recipes(self, count, users, tags, ingredients,
+                       ingredients_per_recipe=(3, 12), tags_per_recipe=(1, 3)):
+        start = next_pk(Recipe)
+        recipes = range(start, start + count)
+        # Те же популярные авторы потом получают больше подписчиков.
+        self.authors = authors = Popularity(users, self.skew, self.random)
+        words = Popularity(TEXT_WORDS, self.skew, self.random)
+        names = list(Ingredient.objects.filter(pk__in=ingredients[:500])
+                     .values_list('name', flat=True)) or ['сыром']
+        self.insert(Recipe, (
+            'id', 'author_id', 'name', 'text', 'cooking_time', 'pub_date'
+        ), (
+            (pk, authors.pick(), self.recipe_name(names),
+             ' '.join(words.pick() for _ in range(self.random.randint(
+                 10, 60))),
+             self.random.randint(5, 180), self.moment(HISTORY_DAYS))
+            for pk in recipes
+        ))
+        self.insert(RecipeTag, ('recipe_id', 'tag_id'), (
+            (pk, tag)
+            for pk in recipes
+            for tag in self.random.sample(tags, min(
+                self.random.randint(*tags_per_recipe), len(tags)))
+        ))
+        popular = Popularity(ingredients, self.skew, self.random)
+        fields = ('recipe_id', 'ingredient_id', 'amount')
+        self.insert(RecipeIngredient, fields, (
+            (pk, ingredient, self.random.randint(1, 500))
+            for pk in recipes
+            for ingredient in popular.pick_many(
+                self.random.randint(*ingredients_per_recipe))
+        ))
+        # Строки вставлены мимо сигналов, поэтому индексы поиска по
+        # рецептам нужно перестроить явно.
+        bump_version(RECIPES)
+        bump_version(PANTRY)
+        return recipes
+
+    def recipe_name(self, ingredient_names):
+        return (f'{self.random.choice(STYLES).capitalize()} '
+                f'{self.random.choice(DISHES)} '
+                f'с {self.random.choice(ingredient_names)}')
+
+    def create_favorites(self, users, recipes, per_user):
+        popular = Popularity(recipes, self.skew, self.random)
+        self.insert(Favorite, ('user_id', 'recipe_id', 'created'), (
+            (user, recipe, self.moment(FAVORITES_DAYS))
+            for user in users
+            for recipe in popular.pick_many(self.activity(per_user))
+        ))
+
+    def create_carts(self, users, recipes, per_user):
+        popular = Popularity(recipes, self.skew, self.random)
+        self.insert(ShoppingCart, ('user_id', 'recipe_id'), (
+            (user, recipe)
+            for user in users
+            for recipe in popular.pick_many(self.activity(per_user))
+        ))
+
+    def create_subscriptions(self, users, per_user):
+        authors = getattr(self, 'authors', None) or Popularity(
+            users, self.skew, self.random)
+        self.insert(Subcribtion, ('user_id', 'author_id'), (
+            (user, author)
+            for user in users
+            for author in authors.pick_many(self.activity(per_user))
+            if author != user
+        ))
+
+    def finish(self, users):
+        reset_sequences([User, Tag, Ingredient, Recipe])
+        call_command('reconcile_counters', stdout=io.StringIO())
+        for start in range(0, len(users), REBUILD_USERS_CHUNK):
+            with transaction.atomic():
+                chunk = list(users[start:start + REBUILD_USERS_CHUNK])
+                ShoppingListItem.objects.rebuild(chunk)
+                FeedEntry.objects.rebuild(user_ids=chunk)
+        self.log('Счётчики, списки покупок и ленты пересчитаны')
+
+    def generate(self, users, recipes, ingredients, tags, favorites=0,
+                 carts=0, subscriptions=0):
+        """favorites, carts и subscriptions — среднее количество
+        на пользователя."""
+        user_pks = self.create_users(users)
+        tag_pks = self.create_tags(tags)
+        ingredient_pks = self.create_ingredients(ingredients)
+        recipe_pks = self.create_recipes(recipes, user_pks, tag_pks,
+                                         ingredient_pks)
+        self.create_favorites(user_pks, recipe_pks, favorites)
+        self.create_carts(user_pks, recipe_pks, carts)
+        self.create_subscriptions(user_pks, subscriptions)
+        self.finish(user_pks)
+        return user_pks, recipe_pks
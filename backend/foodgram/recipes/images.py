@@ -0,0 +1,141 @@
+import binascii
+import logging
+import os
+from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+BASE64_MARKER = ';base64,'
+# Кратно 4, чтобы каждый кусок декодировался независимо.
+BASE64_CHUNK_SIZE = 64 * 1024
+IMAGE_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_PROCESSING_WORKERS,
+    thread_name_prefix='recipe-images'
+)
+
+
+class ImageRejected(ValueError):
+    pass
+
+
+def decode_base64_image(data):
+    """
+    Декодирует картинку из data URL кусками во временный файл (в памяти
+    до IMAGE_SPOOL_MAX_SIZE байт, дальше на диске), не создавая полных
+    копий строки. Размер проверяется до декодирования, а формат и
+    количество пикселей — по заголовку, без распаковки картинки.
+    """
+    start = data.find(BASE64_MARKER, 0, 100)
+    if start == -1:
+        raise ImageRejected('Картинка должна быть передана в base64')
+    start += len(BASE64_MARKER)
+    if (len(data) - start) * 3 // 4 > settings.MAX_IMAGE_UPLOAD_SIZE:
+        raise ImageRejected(
+            'Картинка слишком большая, максимум '
+            f'{settings.MAX_IMAGE_UPLOAD_SIZE // (1024 * 1024)} МБ'
+        )
+    file = SpooledTemporaryFile(max_size=settings.IMAGE_SPOOL_MAX_SIZE)
+    try:
+        for position in range(start, len(data), BASE64_CHUNK_SIZE):
+            file.write(b64decode(
+                data[position:position + BASE64_CHUNK_SIZE], validate=True))
+        file.seek(0)
+        with Image.open(file) as image:
+            image_format = image.format
+            width, height = image.size
+    except Image.DecompressionBombError:
+        file.close()
+        raise ImageRejected('Слишком большое разрешение картинки')
+    except (binascii.Error, ValueError):
+        file.close()
+        raise ImageRejected('Некорректная строка base64')
+    except OSError:
+        file.close()
+        raise ImageRejected('Файл не является картинкой')
+    if image_format not in IMAGE_FORMATS:
+        file.close()
+        raise ImageRejected(f'Формат {image_format} не поддерживается')
+    if width * height > settings.MAX_IMAGE_PIXELS:
+        file.close()
+        raise ImageRejected('Слишком большое разрешение картинки')
+    file.seek(0)
+    return File(file, name=f'temp.{IMAGE_FORMATS[image_format]}')
+
+
+def rendition_name(image_name, rendition):
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f'recipes/renditions/{stem}_{rendition}.webp'
+
+
+def rendition_urls(recipe):
+    """Ссылки на уменьшенные копии картинки рецепта. Пока копии не готовы,
+    вместо них отдаётся ссылка на оригинал."""
+    if not recipe.image:
+        return None
+    storage = default_storage
+    return {
+        rendition: (storage.url(rendition_name(recipe.image.name, rendition))
+                    if recipe.renditions_ready else recipe.image.url)
+        for rendition in settings.IMAGE_RENDITIONS
+    }
+
+
+def make_renditions(image_name):
+    """Копии лежат в обычном хранилище: их имена выводятся из имени
+    оригинала, который уже назван по содержимому. Поэтому готовая копия
+    всегда верна, и повторная загрузка той же картинки не перезаписывает
+    файлы, которые уже отдаются другим рецептам."""
+    storage = default_storage
+    missing = {
+        rendition: size
+        for rendition, size in settings.IMAGE_RENDITIONS.items()
+        if not storage.exists(rendition_name(image_name, rendition))
+    }
+    if not missing:
+        return
+    with storage.open(image_name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    for rendition, size in missing.items():
+        copy = image.copy()
+        copy.thumbnail((size, size), Image.LANCZOS)
+        buffer = BytesIO()
+        copy.save(buffer, 'WEBP', quality=settings.IMAGE_RENDITION_QUALITY)
+        storage.save(rendition_name(image_name, rendition),
+                     ContentFile(buffer.getvalue()))
+
+
+def process_recipe_image(recipe_id, image_name):
+    try:
+        make_renditions(image_name)
+        Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+            renditions_ready=True)
+    except Exception:
+        logger.exception('Не удалось обработать картинку %s', image_name)
+    finally:
+        connection.close()
+
+
+def schedule_renditions(recipe):
+    """Ставит обработку картинки в очередь после фиксации транзакции,
+    чтобы запрос не ждал Pillow."""
+    if not recipe.image:
+        return
+    recipe_id, image_name = recipe.pk, recipe.image.name
+    transaction.on_commit(
+        lambda: executor.submit(process_recipe_image, recipe_id, image_name))
@@ -0,0 +1,249 @@
+import io
+import json
+import platform
+import random
+from datetime import datetime
+from time import perf_counter
+
+from api.metrics import QueryCounter
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import setup_test_environment, teardown_test_environment
+from recipes.bulk import reset_sequences
+from recipes.cache import clear_caches
+from recipes.fake_data import FakeDataGenerator
+from recipes.models import Ingredient, Recipe
+from rest_framework.test import APIClient
+
+User = get_user_model()
+
+DATASET_OPTIONS = ('users', 'recipes', 'ingredients', 'tags', 'favorites',
+                   'carts', 'subscriptions')
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = ('Заполняет временную тестовую базу синтетическими данными и '
+            'измеряет задержку, пропускную способность и число запросов '
+            'к базе для основных эндпоинтов API. Результаты сохраняются '
+            'в JSON и могут сравниваться с прошлым запуском.')
+
+    scenarios = ('recipe_list', 'recipe_list_anonymous', 'recipe_detail',
+                 'recipe_search', 'pantry', 'similar', 'ingredient_search',
+                 'subscriptions', 'feed', 'favorite_toggle', 'cart_toggle',
+                 'download_shopping_cart')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--ingredients', type=int, default=500)
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Среднее число избранных рецептов '
+                                 'у пользователя')
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Среднее число рецептов в корзине')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Среднее число подписок у пользователя')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Сколько раз выполнить каждый сценарий')
+        parser.add_argument('--scenario', action='append',
+                            choices=self.scenarios,
+                            help='Запустить только указанные сценарии')
+        parser.add_argument('--output', help='Куда сохранить результаты')
+        parser.add_argument('--compare',
+                            help='Файл с прошлыми результатами')
+        parser.add_argument('--threshold', type=float, default=20,
+                            help='Допустимый рост медианы задержки, %%')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = self.run_scenarios(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        report = {
+            'meta': {
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'iterations': options['iterations'],
+                'seed': options['seed'],
+                'dataset': {
+                    name: options[name] for name in DATASET_OPTIONS
+                },
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        if options['compare']:
+            self.compare(options['compare'], results, options['threshold'])
+
+    def run_scenarios(self, options):
+        clear_caches()
+        generator = FakeDataGenerator(seed=options['seed'],
+                                      log=self.stdout.write)
+        _, self.recipe_ids = generator.generate(**{
+            name: options[name] for name in DATASET_OPTIONS
+        })
+        call_command('build_recipe_similarity', stdout=io.StringIO())
+        self.rng = random.Random(options['seed'])
+        self.user = User.objects.annotate(
+            in_cart=Count('shopping_cart')).order_by('-in_cart', 'pk')[0]
+        # Отдельные рецепты для добавления в избранное и корзину, чтобы
+        # каждая итерация работала с рецептом, которого там ещё нет.
+        self.toggle_ids = generator.create_recipes(
+            options['iterations'] + 1, [self.user.pk], range(0), range(0))
+        reset_sequences([Recipe])
+        self.ingredient_names = list(
+            Ingredient.objects.values_list('name', flat=True)[:200])
+        # Поисковые фразы — первые два слова названий настоящих
+        # рецептов, чтобы поиск всегда что-то находил.
+        self.search_queries = [
+            ' '.join(name.split()[:2])
+            for name in Recipe.objects.filter(
+                pk__in=self.recipe_ids[:200]).values_list('name', flat=True)
+        ]
+        self.ingredient_ids = list(
+            Ingredient.objects.values_list('pk', flat=True))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.anonymous = APIClient()
+        results = {}
+        for name in options['scenario'] or self.scenarios:
+            results[name] = self.measure(
+                getattr(self, name), options['iterations'])
+            self.stdout.write(
+                f'{name}: p50 {results[name]["p50_ms"]} мс, '
+                f'p95 {results[name]["p95_ms"]} мс, '
+                f'{results[name]["rps"]} запр./с, '
+                f'запросов к базе {results[name]["queries"]}'
+            )
+        return results
+
+    def expect(self, response, *statuses):
+        if response.status_code not in statuses:
+            raise CommandError(
+                f'{response.request["PATH_INFO"]}: '
+                f'ответ {response.status_code}')
+        return response
+
+    def measure(self, scenario, iterations):
+        # Первый вызов строит индексы в памяти процесса, запросы
+        # считаются на втором.
+        scenario(0)
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            scenario(0)
+        timings = []
+        for iteration in range(1, iterations + 1):
+            started = perf_counter()
+            scenario(iteration)
+            timings.append(perf_counter() - started)
+        timings.sort()
+        total = sum(timings)
+        return {
+            'queries': queries.count,
+            'mean_ms': round(total / len(timings) * 1000, 2),
+            'p50_ms': round(percentile(timings, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 2),
+            'rps': round(len(timings) / total, 1),
+        }
+
+    def recipe_list(self, iteration):
+        self.expect(self.client.get(
+            '/api/recipes/', {'page': iteration % 5 + 1, 'limit': 6}), 200)
+
+    def recipe_list_anonymous(self, iteration):
+        self.expect(self.anonymous.get(
+            '/api/recipes/', {'page': iteration % 5 + 1, 'limit': 6}), 200)
+
+    def recipe_detail(self, iteration):
+        recipe_id = self.rng.choice(self.recipe_ids)
+        self.expect(self.client.get(f'/api/recipes/{recipe_id}/'), 200)
+
+    def recipe_search(self, iteration):
+        query = self.rng.choice(self.search_queries)
+        response = self.expect(self.client.get(
+            '/api/recipes/', {'search': query, 'limit': 6}), 200)
+        if not response.data['results']:
+            raise CommandError(f'Поиск «{query}» ничего не нашёл')
+
+    def similar(self, iteration):
+        recipe_id = self.rng.choice(self.recipe_ids)
+        self.expect(self.client.get(
+            f'/api/recipes/{recipe_id}/similar/'), 200)
+
+    def pantry(self, iteration):
+        self.expect(self.client.get('/api/recipes/pantry/', {
+            'ingredients': self.rng.sample(
+                self.ingredient_ids, min(20, len(self.ingredient_ids))),
+            'limit': 6,
+        }), 200)
+
+    def ingredient_search(self, iteration):
+        name = self.rng.choice(self.ingredient_names)
+        self.expect(self.client.get(
+            '/api/ingredients/',
+            {'name': name[:self.rng.randint(2, len(name))]}), 200)
+
+    def subscriptions(self, iteration):
+        self.expect(self.client.get(
+            '/api/users/subscriptions/', {'recipes_limit': 3}), 200)
+
+    def feed(self, iteration):
+        response = self.expect(self.client.get(
+            '/api/recipes/feed/', {'limit': 6}), 200)
+        # Вторая страница проверяет чтение по курсору.
+        if response.data['next']:
+            self.expect(self.client.get(response.data['next']), 200)
+
+    def toggle(self, action, iteration):
+        url = f'/api/recipes/{self.toggle_ids[iteration]}/{action}/'
+        self.expect(self.client.post(url), 201)
+        self.expect(self.client.delete(url), 204)
+
+    def favorite_toggle(self, iteration):
+        self.toggle('favorite', iteration)
+
+    def cart_toggle(self, iteration):
+        self.toggle('shopping_cart', iteration)
+
+    def download_shopping_cart(self, iteration):
+        response = self.expect(self.client.get(
+            '/api/recipes/download_shopping_cart/', {'format': 'txt'}), 200)
+        b''.join(response.streaming_content)
+
+    def compare(self, path, results, threshold):
+        with open(path, encoding='utf-8') as f:
+            previous = json.load(f)['results']
+        regressions = []
+        for name, current in results.items():
+            if name not in previous:
+                continue
+            before = previous[name]
+            change = (current['p50_ms'] - before['p50_ms']) / max(
+                before['p50_ms'], 0.01) * 100
+            self.stdout.write(
+                f'{name}: p50 {before["p50_ms"]} → {current["p50_ms"]} мс '
+                f'({change:+.0f}%), запросов к базе {before["queries"]} → '
+                f'{current["queries"]}'
+            )
+            if change > threshold or current['queries'] > before['queries']:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(f'Регрессии: {", ".join(regressions)}')
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,72 @@
+import base64
+import os
+import tracemalloc
+import zlib
+from io import BytesIO
+from time import perf_counter
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from PIL import Image
+from recipes.images import decode_base64_image
+
+
+def decode_in_memory(data):
+    """Прежний способ: split и b64decode всей строки, затем проверка
+    картинки по полной копии файла, как в forms.ImageField."""
+    format, imgstr = data.split(';base64,')
+    file = ContentFile(base64.b64decode(imgstr),
+                       name='temp.' + format.split('/')[-1])
+    with Image.open(BytesIO(file.read())) as image:
+        image.verify()
+    return file
+
+
+def decode_streaming(data):
+    file = decode_base64_image(data)
+    file.close()
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пиковое потребление памяти при декодировании '
+            'картинки из base64 прежним и потоковым способом')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=float, default=10,
+                            help='Размер картинки в мегабайтах')
+
+    def make_payload(self, size):
+        """PNG нужного размера: небольшая картинка плюс несжимаемый
+        служебный чанк перед IEND, чтобы не тратить время на сжатие."""
+        buffer = BytesIO()
+        Image.new('RGB', (1000, 1000), 'white').save(buffer, 'PNG')
+        png = buffer.getvalue()
+        filler = os.urandom(max(0, size - len(png)))
+        chunk = (len(filler).to_bytes(4, 'big') + b'zzZz' + filler
+                 + zlib.crc32(b'zzZz' + filler).to_bytes(4, 'big'))
+        png = png[:-12] + chunk + png[-12:]
+        return 'data:image/png;base64,' + base64.b64encode(png).decode()
+
+    def measure(self, decode, payload):
+        tracemalloc.start()
+        started = perf_counter()
+        decode(payload)
+        elapsed = perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak, elapsed
+
+    def handle(self, *args, **options):
+        size = int(options['size_mb'] * 1024 * 1024)
+        payload = self.make_payload(size)
+        self.stdout.write(
+            f'Длина строки base64: {len(payload) / 1024 / 1024:.1f} МБ')
+        for label, decode in (('в памяти', decode_in_memory),
+                              ('потоковый', decode_streaming)):
+            with override_settings(MAX_IMAGE_UPLOAD_SIZE=size * 2):
+                peak, elapsed = self.measure(decode, payload)
+            self.stdout.write(
+                f'{label}: пик {peak / 1024 / 1024:.1f} МБ, '
+                f'{elapsed * 1000:.0f} мс'
+            )
@@ -0,0 +1,65 @@
+import random
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from recipes.models import Ingredient
+from recipes.search import IngredientSearchIndex
+
+WORDS = ('абрикос', 'банан', 'вишня', 'говядина', 'дыня', 'ежевика',
+         'зелень', 'изюм', 'капуста', 'лук', 'морковь', 'нут', 'огурец',
+         'перец', 'редис', 'свекла', 'томат', 'укроп', 'фасоль', 'хрен',
+         'чеснок', 'шпинат', 'щавель', 'яблоко')
+SUFFIXES = ('', 'овый', 'ное', 'ная', 'сушёный', 'свежий', 'молотый')
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = ('Измеряет задержку поиска ингредиентов на каждое нажатие '
+            'клавиши по синтетическому или текущему справочнику')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=100_000,
+                            help='Размер синтетического справочника')
+        parser.add_argument('--queries', type=int, default=1000,
+                            help='Сколько названий «набрать» посимвольно')
+        parser.add_argument('--db', action='store_true',
+                            help='Использовать ингредиенты из базы')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def catalog(self, size, rng):
+        for pk in range(1, size + 1):
+            words = rng.sample(WORDS, rng.randint(1, 3))
+            words[0] += rng.choice(SUFFIXES)
+            yield pk, f'{" ".join(words)} {pk}'
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if options['db']:
+            rows = list(Ingredient.objects.values_list('id', 'name'))
+        else:
+            rows = list(self.catalog(options['size'], rng))
+        index = IngredientSearchIndex()
+        started = perf_counter()
+        index.load(rows)
+        build_time = perf_counter() - started
+
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+        timings = []
+        for _, name in rng.sample(rows, min(options['queries'], len(rows))):
+            for length in range(1, len(name) + 1):
+                started = perf_counter()
+                index.search(name[:length], limit)
+                timings.append(perf_counter() - started)
+        timings.sort()
+        self.stdout.write(
+            f'Ингредиентов: {len(rows)}, построение индекса: '
+            f'{build_time * 1000:.0f} мс, запросов: {len(timings)}'
+        )
+        for label, share in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            self.stdout.write(
+                f'{label}: {percentile(timings, share) * 1e6:.1f} мкс')
+        self.stdout.write(f'max: {timings[-1] * 1e6:.1f} мкс')
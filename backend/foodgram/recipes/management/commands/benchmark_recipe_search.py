@@ -0,0 +1,62 @@
+import random
+from time import perf_counter
+
+from api.metrics import QueryCounter
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from recipes.fake_data import DISHES, STYLES, TEXT_WORDS
+from recipes.models import Recipe
+from recipes.search import recipe_index, search_recipes, uses_database_search
+
+from .benchmark_api import percentile
+
+
+class Command(BaseCommand):
+    help = ('Измеряет задержку поиска по рецептам на текущей базе. Для '
+            'замеров на больших объёмах базу сначала заполняют командой '
+            'generate_fake_data, например --recipes 1000000.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--page-size', type=int, default=6)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        total = Recipe.objects.count()
+        if not total:
+            raise CommandError('В базе нет рецептов')
+        if uses_database_search():
+            self.stdout.write(f'{connection.vendor}: полнотекстовый индекс, '
+                              f'рецептов {total}')
+        else:
+            started = perf_counter()
+            recipe_index.ensure_fresh()
+            self.stdout.write(
+                f'{connection.vendor}: индекс в памяти по {total} рецептам '
+                f'построен за {perf_counter() - started:.2f} с')
+        rng = random.Random(options['seed'])
+        queries = [
+            rng.choice(DISHES),
+            f'{rng.choice(STYLES)} {rng.choice(DISHES)}',
+            rng.choice(DISHES)[:4],
+            f'{rng.choice(DISHES)} {rng.choice(TEXT_WORDS)}',
+        ]
+        for query in queries:
+            self.measure(query, options['iterations'], options['page_size'])
+
+    def measure(self, query, iterations, page_size):
+        timings = []
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            for _ in range(iterations):
+                started = perf_counter()
+                page = list(search_recipes(
+                    Recipe.objects.all(), query)[:page_size])
+                timings.append(perf_counter() - started)
+        timings.sort()
+        self.stdout.write(
+            f'«{query}»: p50 {percentile(timings, 0.5) * 1000:.2f} мс, '
+            f'p95 {percentile(timings, 0.95) * 1000:.2f} мс, '
+            f'на странице {len(page)}, '
+            f'запросов к базе {counter.count // iterations}'
+        )
@@ -0,0 +1,122 @@
+from itertools import islice
+from time import monotonic
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from recipes.bulk import copy_rows, insert_rows
+from recipes.models import Favorite, Recipe, RecipeSimilarity
+from recipes.similarity import SimilarityBuilder
+
+FIELDS = ('recipe_id', 'similar_id', 'score', 'computed')
+
+
+class Command(BaseCommand):
+    help = ('Считает для каждого рецепта самые похожие рецепты по общему '
+            'избранному и ингредиентам. С --incremental пересчитывает '
+            'только рецепты, опубликованные или добавленные в избранное '
+            'после прошлого расчёта, и списки их соседей.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true')
+        parser.add_argument('--top', type=int,
+                            default=settings.SIMILAR_RECIPES_COUNT,
+                            help='Сколько соседей хранить у рецепта')
+        parser.add_argument('--max-ingredient-recipes', type=int,
+                            default=1000,
+                            help='Не сравнивать по ингредиентам, которые '
+                                 'есть в большем числе рецептов')
+        parser.add_argument('--max-user-favorites', type=int, default=500,
+                            help='Сколько последних избранных рецептов '
+                                 'пользователя учитывать')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        started = monotonic()
+        self.batch_size = options['batch_size']
+        self.builder = SimilarityBuilder(
+            options['top'],
+            max_ingredient_recipes=options['max_ingredient_recipes'],
+            max_user_favorites=options['max_user_favorites'],
+        )
+        since = RecipeSimilarity.objects.aggregate(
+            since=Max('computed'))['since']
+        # Отметка ставится до чтения данных: избранное, добавленное во
+        # время расчёта, попадёт в следующий инкрементальный запуск.
+        self.computed = timezone.now()
+        self.builder.load()
+        self.stdout.write(f'Данные загружены за {monotonic() - started:.1f} с')
+        if options['incremental'] and since is not None:
+            count = self.refresh(since)
+        else:
+            count = self.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитаны соседи {count} рецептов за '
+            f'{monotonic() - started:.1f} с'))
+
+    def write(self, rows):
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            if connection.vendor == 'postgresql':
+                copy_rows(RecipeSimilarity, FIELDS, batch)
+            else:
+                insert_rows(RecipeSimilarity, FIELDS, batch)
+
+    def rebuild(self):
+        recipes = self.builder.recipes()
+        # Читатели видят прежние списки, пока транзакция не завершится.
+        with transaction.atomic():
+            RecipeSimilarity.objects.all().delete()
+            self.write(
+                (recipe_id, similar_id, score, self.computed)
+                for recipe_id in recipes
+                for similar_id, score in self.builder.best(
+                    self.builder.scores(recipe_id))
+            )
+        return len(recipes)
+
+    def refresh(self, since):
+        """
+        Пересчитывает списки изменившихся рецептов целиком, а в списки
+        остальных рецептов вливает новые значения сходства с ними:
+        сходство симметрично, остальные пары не изменились. Списки, где
+        уже были изменившиеся рецепты, тоже пересчитываются целиком —
+        сходство с ними могло уменьшиться.
+        """
+        changed = set(Favorite.objects.filter(
+            created__gt=since).values_list('recipe_id', flat=True))
+        changed |= set(Recipe.objects.filter(
+            pub_date__gt=since).values_list('pk', flat=True))
+        changed |= set(RecipeSimilarity.objects.filter(
+            similar_id__in=changed).values_list('recipe_id', flat=True))
+        lists = {}
+        updates = {}
+        for recipe_id in changed:
+            scores = self.builder.scores(recipe_id)
+            lists[recipe_id] = self.builder.best(scores)
+            for other, score in scores.items():
+                if other not in changed:
+                    updates.setdefault(other, {})[recipe_id] = score
+        current = {}
+        for recipe_id, similar_id, score in RecipeSimilarity.objects.filter(
+                recipe_id__in=updates).values_list(
+                    'recipe_id', 'similar_id', 'score').iterator():
+            current.setdefault(recipe_id, {})[similar_id] = score
+        for recipe_id, scores in updates.items():
+            old = current.get(recipe_id, {})
+            new = self.builder.best({**old, **scores})
+            if new != self.builder.best(old):
+                lists[recipe_id] = new
+        with transaction.atomic():
+            RecipeSimilarity.objects.filter(recipe_id__in=lists).delete()
+            self.write(
+                (recipe_id, similar_id, score, self.computed)
+                for recipe_id, neighbours in lists.items()
+                for similar_id, score in neighbours
+            )
+        return len(lists)
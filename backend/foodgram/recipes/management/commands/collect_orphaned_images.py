@@ -0,0 +1,71 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from recipes.images import rendition_name
+from recipes.models import Recipe
+
+IMAGES_DIR = 'recipes'
+RENDITIONS_DIR = 'recipes/renditions'
+
+
+def walk(storage, path):
+    """Все файлы каталога path в хранилище, кроме уменьшенных копий."""
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield os.path.join(path, name)
+    for directory in directories:
+        subpath = os.path.join(path, directory)
+        if subpath != RENDITIONS_DIR:
+            yield from walk(storage, subpath)
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки рецептов, на которые не ссылается ни один '
+            'рецепт, вместе с их уменьшенными копиями')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет удалено')
+        parser.add_argument('--min-age-hours', type=float, default=1,
+                            help='Не трогать файлы моложе этого возраста: '
+                                 'рецепт с ними может быть ещё не сохранён')
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field('image').storage
+        if not storage.exists(IMAGES_DIR):
+            self.stdout.write('Картинок нет')
+            return
+        threshold = timezone.now() - timedelta(
+            hours=options['min_age_hours'])
+        referenced = set(
+            Recipe.objects.exclude(image='').exclude(image=None)
+            .values_list('image', flat=True).iterator()
+        )
+        removed = freed = 0
+        for name in walk(storage, IMAGES_DIR):
+            if name in referenced:
+                continue
+            if storage.get_modified_time(name) > threshold:
+                continue
+            if Recipe.objects.filter(image=name).exists():
+                continue
+            related = [name] + [
+                rendition_name(name, rendition)
+                for rendition in settings.IMAGE_RENDITIONS
+            ]
+            for path in related:
+                if not default_storage.exists(path):
+                    continue
+                freed += default_storage.size(path)
+                if not options['dry_run']:
+                    default_storage.delete(path)
+            removed += 1
+            self.stdout.write(name)
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} картинок: {removed}, '
+            f'освобождено {freed / (1024 * 1024):.1f} МБ'))
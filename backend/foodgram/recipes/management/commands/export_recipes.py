@@ -0,0 +1,66 @@
+import json
+from time import monotonic
+
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+from recipes.models import Recipe, RecipeIngredient
+
+
+def recipe_to_dict(recipe):
+    """Запись рецепта для JSON Lines: связи заданы естественными ключами —
+    логином автора, слагами тегов, названием и единицей ингредиента."""
+    return {
+        'author': recipe.author.username if recipe.author else None,
+        'name': recipe.name,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+        'image': recipe.image.name or None,
+        'pub_date': recipe.pub_date.isoformat(),
+        'tags': [tag.slug for tag in recipe.tags.all()],
+        'ingredients': [
+            {
+                'name': item.ingredient.name,
+                'measurement_unit': item.ingredient.measurement_unit,
+                'amount': item.amount,
+            }
+            for item in recipe.ingredientinrecipe.all()
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Выгружает рецепты с ингредиентами и тегами в файл JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_file', type=str)
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько рецептов читать за один запрос')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        recipes = Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch('ingredientinrecipe',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient').order_by('pk'))
+        ).order_by('pk')
+        started = monotonic()
+        total = last_pk = 0
+        with open(options['output_file'], 'w', encoding='utf-8') as f:
+            while True:
+                # iterator() не поддерживает prefetch_related, поэтому
+                # рецепты читаются пачками по первичному ключу.
+                batch = list(recipes.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+                for recipe in batch:
+                    f.write(json.dumps(recipe_to_dict(recipe),
+                                       ensure_ascii=False))
+                    f.write('\n')
+                last_pk = batch[-1].pk
+                total += len(batch)
+                self.stdout.write(f'Выгружено рецептов: {total}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгружено рецептов: {total}, '
+            f'время: {monotonic() - started:.2f} с'
+        ))
@@ -0,0 +1,49 @@
+from time import monotonic
+
+from django.core.management.base import BaseCommand
+from recipes.fake_data import FAKE_PASSWORD, FakeDataGenerator
+
+
+class Command(BaseCommand):
+    help = ('Создаёт синтетических пользователей, рецепты, избранное, '
+            'корзины и подписки для нагрузочного тестирования')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--recipes', type=int, default=100_000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--tags', type=int, default=20)
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Среднее число избранных рецептов '
+                                 'у пользователя')
+        parser.add_argument('--carts', type=int, default=3,
+                            help='Среднее число рецептов в корзине')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Среднее число подписок у пользователя')
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help='Показатель распределения Ципфа для '
+                                 'популярности; 0 — равномерно')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Вставлять через INSERT даже '
+                                 'на PostgreSQL')
+
+    def handle(self, *args, **options):
+        started = monotonic()
+        generator = FakeDataGenerator(
+            seed=options['seed'], skew=options['skew'],
+            batch_size=options['batch_size'],
+            use_copy=not options['no_copy'],
+            log=lambda message: self.stdout.write(
+                f'[{monotonic() - started:7.1f} с] {message}')
+        )
+        generator.generate(
+            users=options['users'], recipes=options['recipes'],
+            ingredients=options['ingredients'], tags=options['tags'],
+            favorites=options['favorites'], carts=options['carts'],
+            subscriptions=options['subscriptions'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {monotonic() - started:.1f} с. Пароль всех '
+            f'пользователей: {FAKE_PASSWORD}'))
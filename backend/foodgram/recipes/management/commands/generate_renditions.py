@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from recipes.images import make_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Создаёт уменьшенные копии картинок рецептов, для которых '
+            'они ещё не готовы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Пересоздать копии для всех рецептов')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').exclude(image=None)
+        if not options['all']:
+            recipes = recipes.filter(renditions_ready=False)
+        done = failed = 0
+        for pk, image_name in recipes.values_list('pk', 'image').iterator():
+            try:
+                make_renditions(image_name)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'Рецепт {pk}: {error}')
+                continue
+            Recipe.objects.filter(pk=pk, image=image_name).update(
+                renditions_ready=True)
+            done += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {done}, с ошибками: {failed}'))
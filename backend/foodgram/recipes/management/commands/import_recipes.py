@@ -0,0 +1,164 @@
+import json
+from collections import Counter
+from itertools import islice
+from time import monotonic
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Case, DateTimeField, F, Value, When
+from recipes.cache import PANTRY, RECIPES, bump_version
+from recipes.models import (FeedEntry, Ingredient, Recipe, RecipeIngredient,
+                            RecipeTag, Tag)
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Загружает рецепты с ингредиентами и тегами из файла JSON Lines, '
+            'созданного командой export_recipes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('input_file', type=str)
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько рецептов сохранять в одной '
+                                 'транзакции')
+        parser.add_argument('--author',
+                            help='Логин автора для рецептов, чей автор не '
+                                 'найден')
+
+    def handle(self, *args, **options):
+        self.tags = dict(Tag.objects.values_list('slug', 'pk'))
+        self.ingredients = {
+            (name, measurement_unit): pk
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'pk', 'name', 'measurement_unit').iterator()
+        }
+        self.default_author = None
+        if options['author']:
+            self.default_author = User.objects.filter(
+                username=options['author']).first()
+            if self.default_author is None:
+                raise CommandError(
+                    f'Пользователь {options["author"]} не найден')
+        started = monotonic()
+        total = 0
+        with open(options['input_file'], encoding='utf-8') as f:
+            lines = (
+                (number, line) for number, line in enumerate(f, start=1)
+                if line.strip()
+            )
+            while True:
+                batch = list(islice(lines, options['batch_size']))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    self.save_batch(self.parse_batch(batch))
+                total += len(batch)
+                self.stdout.write(f'Загружено рецептов: {total}')
+        # bulk_create не отправляет сигналы, которые обновляют индексы.
+        bump_version(RECIPES)
+        bump_version(PANTRY)
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено рецептов: {total}, '
+            f'время: {monotonic() - started:.2f} с'
+        ))
+
+    def lookup(self, mapping, key, message):
+        if key not in mapping:
+            raise CommandError(message)
+        return mapping[key]
+
+    @staticmethod
+    def clean(model, field_name, value):
+        """Проверяет значение валидаторами поля модели: ошибка в одной
+        строке не должна доходить до базы."""
+        try:
+            value = model._meta.get_field(field_name).clean(value, None)
+        except ValidationError as error:
+            raise CommandError(f'{field_name}: {" ".join(error.messages)}')
+        if value is None:
+            raise CommandError(f'{field_name}: значение не указано')
+        return value
+
+    def build(self, data, authors):
+        author = authors.get(data['author'], self.default_author)
+        if author is None:
+            raise CommandError(f'автор {data["author"]} не найден')
+        recipe = Recipe(
+            author=author,
+            image=data.get('image') or None,
+            **{
+                field_name: self.clean(Recipe, field_name, data[field_name])
+                for field_name in ('name', 'text', 'cooking_time', 'pub_date')
+            }
+        )
+        # Повтор тега не ошибка, но второй RecipeTag нарушил бы
+        # уникальность.
+        tags = [self.lookup(self.tags, slug, f'тег {slug} не найден')
+                for slug in dict.fromkeys(data['tags'])]
+        ingredients = {}
+        for item in data['ingredients']:
+            key = (item['name'], item['measurement_unit'])
+            pk = self.lookup(self.ingredients, key,
+                             f'ингредиент {" ".join(key)} не найден')
+            if pk in ingredients:
+                raise CommandError(f'ингредиент {" ".join(key)} указан дважды')
+            ingredients[pk] = self.clean(
+                RecipeIngredient, 'amount', item['amount'])
+        return recipe, tags, ingredients
+
+    def parse_batch(self, batch):
+        records = []
+        for number, line in batch:
+            try:
+                records.append((number, json.loads(line)))
+            except ValueError as error:
+                raise CommandError(f'Строка {number}: {error}')
+        authors = User.objects.in_bulk(
+            {data.get('author') for _, data in records},
+            field_name='username')
+        parsed = []
+        for number, data in records:
+            try:
+                parsed.append(self.build(data, authors))
+            except KeyError as error:
+                raise CommandError(f'Строка {number}: нет поля {error}')
+            except (CommandError, TypeError, ValueError) as error:
+                raise CommandError(f'Строка {number}: {error}')
+        return parsed
+
+    def save_batch(self, parsed):
+        recipes = [recipe for recipe, _, _ in parsed]
+        pub_dates = [recipe.pub_date for recipe in recipes]
+        if connection.features.can_return_ids_from_bulk_insert:
+            Recipe.objects.bulk_create(recipes)
+        else:
+            # SQLite не возвращает ключи из bulk_create.
+            for recipe in recipes:
+                recipe.save()
+        # auto_now_add заменил даты публикации текущим временем:
+        # возвращаем исходные одним запросом.
+        for recipe, pub_date in zip(recipes, pub_dates):
+            recipe.pub_date = pub_date
+        Recipe.objects.filter(pk__in=[recipe.pk for recipe in recipes]).update(
+            pub_date=Case(
+                *[When(pk=recipe.pk, then=Value(recipe.pub_date))
+                  for recipe in recipes],
+                output_field=DateTimeField(),
+            ))
+        RecipeTag.objects.bulk_create([
+            RecipeTag(recipe=recipe, tag_id=tag)
+            for recipe, tags, _ in parsed for tag in tags
+        ])
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=recipe, ingredient_id=pk, amount=amount)
+            for recipe, _, ingredients in parsed
+            for pk, amount in ingredients.items()
+        ])
+        FeedEntry.objects.fan_out(recipes)
+        per_author = Counter(recipe.author_id for recipe in recipes)
+        for author_id, count in per_author.items():
+            User.objects.filter(pk=author_id).update(
+                recipes_count=F('recipes_count') + count)
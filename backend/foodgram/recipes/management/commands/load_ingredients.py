@@ -1,17 +1,112 @@
+import csv
 import json
+import os
+from itertools import islice
+from time import monotonic
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.cache import INGREDIENTS, bump_version
 from recipes.models import Ingredient
 
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(file):
+    """Разбирает JSON-массив по одному объекту, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in iter(lambda: file.read(READ_CHUNK_SIZE), ''):
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise CommandError('Ожидается JSON-массив ингредиентов')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item
+        buffer = buffer[position:]
+    if buffer.strip():
+        raise CommandError('Файл с ингредиентами обрывается')
+
+
+def read_json(file):
+    for item in iter_json_array(file):
+        yield item['name'], item['measurement_unit']
+
+
+def read_csv(file):
+    reader = csv.reader(file)
+    for row in reader:
+        if not row:
+            continue
+        if row == ['name', 'measurement_unit']:
+            continue
+        if len(row) != 2:
+            raise CommandError(
+                f'Строка {reader.line_num}: ожидается 2 столбца, '
+                f'получено {len(row)}')
+        name, measurement_unit = row
+        yield name, measurement_unit
+
+
+READERS = {
+    'json': read_json,
+    'csv': read_csv,
+}
+
 
 class Command(BaseCommand):
-    help = 'Загружает данные json по ингредиентам в модель'
+    help = 'Загружает данные json или csv по ингредиентам в модель'
 
     def add_arguments(self, parser):
         parser.add_argument('ingredients_file', type=str)
+        parser.add_argument('--format', choices=READERS.keys(),
+                            help='Формат файла, по умолчанию — по '
+                                 'расширению')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько строк вставлять за один запрос')
 
     def handle(self, *args, **options):
-        with open(options['ingredients_file']) as f:
-            data = json.load(f)
-        for ingredient in data:
-            Ingredient.objects.create(**ingredient)
+        path = options['ingredients_file']
+        file_format = (options['format']
+                       or os.path.splitext(path)[1].lstrip('.').lower())
+        if file_format not in READERS:
+            raise CommandError(
+                f'Неизвестный формат файла: {file_format or path}')
+        batch_size = options['batch_size']
+        started = monotonic()
+        total = 0
+        with open(path, encoding='utf-8') as f, transaction.atomic():
+            before = Ingredient.objects.count()
+            rows = (
+                (name.strip(), measurement_unit.strip())
+                for name, measurement_unit in READERS[file_format](f)
+            )
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                Ingredient.objects.bulk_create([
+                    Ingredient(name=name, measurement_unit=measurement_unit)
+                    for name, measurement_unit in batch
+                ], ignore_conflicts=True)
+                total += len(batch)
+            inserted = Ingredient.objects.count() - before
+        bump_version(INGREDIENTS)
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {total}, добавлено: {inserted}, '
+            f'пропущено: {total - inserted}, '
+            f'время: {monotonic() - started:.2f} с'
+        ))
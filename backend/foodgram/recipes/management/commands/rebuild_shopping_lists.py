@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает списки покупок пользователей по содержимому '
+            'корзин или проверяет их на расхождения')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            dest='user_ids',
+                            help='Обработать только указанных пользователей')
+        parser.add_argument('--verify', action='store_true',
+                            help='Только проверить, ничего не изменяя')
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        if options['verify']:
+            self.verify(user_ids)
+            return
+        with transaction.atomic():
+            ShoppingListItem.objects.rebuild(user_ids)
+        self.stdout.write(self.style.SUCCESS('Списки покупок пересчитаны'))
+
+    def verify(self, user_ids):
+        expected = ShoppingListItem.objects.compute(user_ids)
+        items = ShoppingListItem.objects.filter(amount__gt=0)
+        if user_ids is not None:
+            items = items.filter(user_id__in=user_ids)
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in items.values_list('user_id', 'ingredient_id', 'amount')
+        }
+        mismatches = sorted(
+            key for key in expected.keys() | stored.keys()
+            if expected.get(key) != stored.get(key)
+        )
+        for user_id, ingredient_id in mismatches:
+            self.stdout.write(
+                f'user={user_id} ingredient={ingredient_id}: '
+                f'ожидается {expected.get((user_id, ingredient_id), 0)}, '
+                f'сохранено {stored.get((user_id, ingredient_id), 0)}'
+            )
+        if mismatches:
+            self.stderr.write(f'Найдено расхождений: {len(mismatches)}')
+        else:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
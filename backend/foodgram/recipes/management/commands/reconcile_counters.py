@@ -0,0 +1,51 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from recipes.models import Favorite, Recipe, ShoppingCart, Subcribtion
+
+User = get_user_model()
+
+
+def count_of(model, field):
+    """Подзапрос с количеством строк model, ссылающихся на текущую запись
+    через поле field."""
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(total=Count('pk')).values('total'),
+        output_field=IntegerField()
+    ), 0)
+
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subcribtion, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает денормализованные счётчики избранного, корзин, '
+            'рецептов и подписчиков')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for model, field, related_model, related_field in COUNTERS:
+                actual = count_of(related_model, related_field)
+                drifted = model.objects.annotate(actual=actual).exclude(
+                    **{field: F('actual')}).count()
+                if drifted and not options['dry_run']:
+                    model.objects.update(**{field: actual})
+                self.stdout.write(
+                    f'{model._meta.model_name}.{field}: '
+                    f'расхождений {drifted}'
+                )
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны'))
@@ -0,0 +1,66 @@
+import math
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from recipes.models import Favorite, Recipe
+
+# Рейтинг хранится в логарифмической шкале от фиксированного момента:
+# log Σ exp(decay · (created − EPOCH)). Порядок рецептов тот же, что
+# у суммы затухающих вкладов на момент расчёта, но со временем значение
+# не меняется, поэтому перезаписываются только рецепты, у которых
+# изменилось избранное внутри окна.
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает рейтинг «набирающих популярность» рецептов: '
+            'добавления в избранное за окно с экспоненциальным затуханием')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window-days', type=float, default=7,
+                            help='Сколько дней избранного учитывать')
+        parser.add_argument('--half-life-hours', type=float, default=24,
+                            help='За сколько часов вклад добавления '
+                                 'в избранное уменьшается вдвое')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['window_days'])
+        decay = math.log(2) / (options['half_life_hours'] * 3600)
+        # Логарифм суммы экспонент копится потоком: (максимум, сумма
+        # exp(x − максимум)), чтобы не переполнить float.
+        sums = {}
+        favorites = Favorite.objects.filter(
+            created__gte=since
+        ).values_list('recipe_id', 'created').iterator()
+        for recipe_id, created in favorites:
+            power = decay * (created - EPOCH).total_seconds()
+            top, total = sums.get(recipe_id, (power, 0.0))
+            if power > top:
+                total *= math.exp(top - power)
+                top = power
+            sums[recipe_id] = (top, total + math.exp(power - top))
+        scores = {
+            pk: top + math.log(total) for pk, (top, total) in sums.items()
+        }
+        current = dict(Recipe.objects.filter(
+            trending_score__gt=0).values_list('pk', 'trending_score'))
+        changed = [
+            Recipe(pk=pk, trending_score=score)
+            for pk, score in scores.items()
+            if not math.isclose(current.get(pk, 0), score, rel_tol=1e-9)
+        ]
+        with transaction.atomic():
+            reset = Recipe.objects.annotate(trending=Exists(
+                Favorite.objects.filter(
+                    recipe=OuterRef('pk'), created__gte=since))
+            ).filter(trending_score__gt=0, trending=False).update(
+                trending_score=0)
+            Recipe.objects.bulk_update(
+                changed, ['trending_score'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Рейтинг изменился у {len(changed)} рецептов из '
+            f'{len(scores)}, обнулён у {reset}'))
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_feed_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='renditions_ready',
+            field=models.BooleanField(default=False, verbose_name='Уменьшенные копии картинки готовы'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+# Замороженная копия recipes.search.SEARCH_DOCUMENT на момент миграции:
+# если выражение в коде изменится, индекс пересоздаёт новая миграция.
+CREATE_INDEX = '''
+    CREATE INDEX IF NOT EXISTS recipe_search_idx ON recipes_recipe
+    USING GIN ((
+        setweight(to_tsvector('russian', "recipes_recipe"."name"), 'A') ||
+        setweight(to_tsvector('russian', "recipes_recipe"."text"), 'B')
+    ))
+'''
+DROP_INDEX = 'DROP INDEX IF EXISTS recipe_search_idx'
+
+
+def run_on_postgresql(sql):
+    """На остальных базах поиск идёт по индексу в памяти процесса."""
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_postgresql(CREATE_INDEX),
+                             run_on_postgresql(DROP_INDEX)),
+    ]
@@ -1,6 +1,15 @@
+from datetime import timedelta
+from heapq import merge
+from itertools import groupby, islice
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.utils import timezone
+
+from .storage import ContentAddressedStorage
 
 User = get_user_model()
 
@@ -15,6 +24,9 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ('name', )
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'measurement_unit'],
+                                    name='unique_ingredient')]
 
     def __str__(self):
         return f'{self.name} {self.measurement_unit}'
@@ -44,7 +56,10 @@ class Recipe(models.Model):
                                related_name='recipes', null=True)
     name = models.CharField(verbose_name='Название блюда', max_length=200)
     image = models.ImageField(verbose_name='Картинка к рецепту',
-                              upload_to='recipes/', null=True, blank=True)
+                              upload_to='recipes/', null=True, blank=True,
+                              storage=ContentAddressedStorage())
+    renditions_ready = models.BooleanField(
+        verbose_name='Уменьшенные копии картинки готовы', default=False)
     text = models.TextField(verbose_name='Описание рецепта')
     ingredients = models.ManyToManyField(Ingredient,
                                          verbose_name='Ингредиенты',
@@ -55,11 +70,27 @@ class Recipe(models.Model):
                                        verbose_name='Время готовки')
     pub_date = models.DateTimeField(verbose_name='Дата публикации',
                                     auto_now_add=True,)
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном', default=0)
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В корзинах', default=0)
+    trending_score = models.FloatField(
+        verbose_name='Рейтинг популярности за последнее время', default=0)
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_feed_idx'),
+            models.Index(fields=['-favorites_count', '-pub_date'],
+                         name='recipe_popular_idx'),
+            models.Index(fields=['-trending_score', '-pub_date'],
+                         name='recipe_trending_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_feed_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -134,6 +165,8 @@ class Favorite(models.Model):
                              related_name='favorites')
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
                                related_name='favorites')
+    created = models.DateTimeField(verbose_name='Дата добавления',
+                                   auto_now_add=True, db_index=True)
 
     class Meta:
         verbose_name = 'Избранный рецепт'
@@ -165,3 +198,292 @@ class ShoppingCart(models.Model):
                 name='unique_recipe_in_user_cart'
             ),
         )
+
+
+class ShoppingListItemManager(models.Manager):
+    """Поддерживает агрегированный список покупок в актуальном состоянии."""
+
+    @staticmethod
+    def recipe_amounts(recipe):
+        return dict(RecipeIngredient.objects.filter(recipe=recipe).values_list(
+            'ingredient_id', 'amount'))
+
+    def apply_deltas(self, user_ids, deltas):
+        """Прибавляет к списку покупок пользователей изменения количества
+        ингредиентов вида {ingredient_id: delta} за два запроса."""
+        user_ids = list(user_ids)
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        if not user_ids or not deltas:
+            return
+        self.bulk_create([
+            self.model(user_id=user_id, ingredient_id=ingredient_id, amount=0)
+            for user_id in user_ids for ingredient_id in deltas
+        ], ignore_conflicts=True)
+        self.filter(
+            user_id__in=user_ids, ingredient_id__in=deltas
+        ).update(amount=F('amount') + Case(
+            *[When(ingredient_id=pk, then=Value(delta))
+              for pk, delta in deltas.items()],
+            output_field=models.IntegerField()
+        ), updated=timezone.now())
+
+    def add_recipe(self, user, recipe):
+        self.apply_deltas([user.pk], self.recipe_amounts(recipe))
+
+    def remove_recipe(self, user, recipe):
+        self.apply_deltas([user.pk], {
+            pk: -amount for pk, amount in self.recipe_amounts(recipe).items()
+        })
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """Переносит изменение состава рецепта в списки покупок всех
+        пользователей, у которых рецепт лежит в корзине."""
+        deltas = {
+            pk: new_amounts.get(pk, 0) - old_amounts.get(pk, 0)
+            for pk in old_amounts.keys() | new_amounts.keys()
+        }
+        self.apply_deltas(
+            ShoppingCart.objects.filter(recipe=recipe).values_list(
+                'user_id', flat=True),
+            deltas
+        )
+
+    # Столько строк передаётся в один bulk_create при пересчёте; на
+    # запросы пачку делит сам Django с учётом ограничений базы.
+    batch_size = 1000
+
+    @staticmethod
+    def totals(user_ids=None):
+        amounts = RecipeIngredient.objects.filter(
+            recipe__in_shopping_cart__isnull=False
+        )
+        if user_ids is not None:
+            amounts = amounts.filter(
+                recipe__in_shopping_cart__user_id__in=user_ids)
+        return amounts.values(
+            'recipe__in_shopping_cart__user', 'ingredient'
+        ).annotate(total=Sum('amount')).order_by()
+
+    def compute(self, user_ids=None):
+        """Считает список покупок заново по содержимому корзин."""
+        return {
+            (row['recipe__in_shopping_cart__user'], row['ingredient']):
+                row['total']
+            for row in self.totals(user_ids)
+        }
+
+    def rebuild(self, user_ids=None):
+        """Пересчитывает списки покупок, читая суммы потоком и создавая
+        строки пачками по batch_size."""
+        items = self.all()
+        if user_ids is not None:
+            items = items.filter(user_id__in=user_ids)
+        items.delete()
+        rows = self.totals(user_ids).iterator()
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            self.bulk_create([
+                self.model(user_id=row['recipe__in_shopping_cart__user'],
+                           ingredient_id=row['ingredient'],
+                           amount=row['total'])
+                for row in batch
+            ])
+
+
+class ShoppingListItem(models.Model):
+    """Суммарное количество ингредиента в корзине пользователя"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             verbose_name='Пользователь',
+                             related_name='shopping_list')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE,
+                                   verbose_name='Ингредиент')
+    amount = models.IntegerField(verbose_name='Количество ингредиента',
+                                 default=0)
+    updated = models.DateTimeField(verbose_name='Дата изменения',
+                                   auto_now=True)
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Список покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_ingredient_in_shopping_list'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user} {self.ingredient} {self.amount}'
+
+
+class FeedEntryManager(models.Manager):
+    """
+    Ленты подписок: новый рецепт записывается в ленты подписчиков
+    автора, если их не больше FEED_FANOUT_MAX_FOLLOWERS. Рецепты более
+    популярных авторов в ленты не копируются, а подмешиваются при чтении.
+    При подписке и пересборке в ленту попадают рецепты только за
+    последние FEED_BACKFILL_DAYS дней.
+    """
+    batch_size = 5000
+
+    @staticmethod
+    def small_authors():
+        return Q(author__followers_count__lte=(
+            settings.FEED_FANOUT_MAX_FOLLOWERS))
+
+    @classmethod
+    def backfill(cls):
+        return cls.small_authors() & Q(pub_date__gte=(
+            timezone.now() - timedelta(days=settings.FEED_BACKFILL_DAYS)))
+
+    def fan_out(self, recipes):
+        """Добавляет рецепты в ленты подписчиков их авторов."""
+        by_author = {}
+        for recipe in recipes:
+            by_author.setdefault(recipe.author_id, []).append(recipe)
+        followers = Subcribtion.objects.filter(
+            self.small_authors(), author_id__in=by_author
+        ).order_by().values_list('author_id', 'user_id')
+        self.bulk_create([
+            self.model(user_id=user_id, recipe=recipe, author_id=author_id,
+                       pub_date=recipe.pub_date)
+            for author_id, user_id in followers
+            for recipe in by_author[author_id]
+        ], ignore_conflicts=True)
+
+    def follow(self, user, author):
+        self.insert(
+            (user.pk, pk, author.pk, pub_date)
+            for pk, pub_date in Recipe.objects.filter(
+                self.backfill(), author=author
+            ).values_list('pk', 'pub_date').iterator()
+        )
+
+    def unfollow(self, user, author):
+        self.filter(user=user, author=author).delete()
+        # Автор с этой отписки снова попадает под рассылку по лентам,
+        # а у части подписчиков его рецептов там нет.
+        if User.objects.filter(
+                pk=author.pk,
+                followers_count=settings.FEED_FANOUT_MAX_FOLLOWERS).exists():
+            self.rebuild(author_ids=[author.pk])
+
+    def insert(self, rows):
+        """Вставляет записи из кортежей (пользователь, рецепт, автор,
+        дата) пачками по batch_size."""
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            self.bulk_create([
+                self.model(user_id=user_id, recipe_id=recipe_id,
+                           author_id=author_id, pub_date=pub_date)
+                for user_id, recipe_id, author_id, pub_date in batch
+            ], ignore_conflicts=True)
+
+    def rebuild(self, user_ids=None, author_ids=None):
+        """Заполняет ленты заново по подпискам и рецептам."""
+        entries = self.all()
+        conditions = self.backfill()
+        if user_ids is not None:
+            entries = entries.filter(user_id__in=user_ids)
+            conditions &= Q(author__following__user_id__in=user_ids)
+        if author_ids is not None:
+            entries = entries.filter(author_id__in=author_ids)
+            conditions &= Q(author_id__in=author_ids)
+        entries.delete()
+        self.insert(Recipe.objects.filter(
+            conditions, author__following__isnull=False
+        ).order_by().values_list(
+            'author__following__user_id', 'pk', 'author_id', 'pub_date'
+        ).iterator())
+
+    def page(self, user, after, limit):
+        """
+        До limit пар (дата публикации, id рецепта) ленты пользователя
+        после позиции after в порядке от новых к старым. Записи ленты
+        сливаются с рецептами популярных авторов, прочитанными из
+        таблицы рецептов; повторы (рецепты, разосланные до того, как
+        автор стал популярным) отбрасываются.
+        """
+        entries = self.filter(user=user)
+        popular = list(Subcribtion.objects.filter(
+            user=user,
+            author__followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS
+        ).order_by().values_list('author_id', flat=True))
+        recipes = Recipe.objects.filter(author_id__in=popular)
+        if after is not None:
+            pub_date, pk = after
+            entries = entries.filter(
+                Q(pub_date__lt=pub_date)
+                | Q(pub_date=pub_date, recipe_id__lt=pk))
+            recipes = recipes.filter(
+                Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk))
+        sources = [entries.order_by('-pub_date', '-recipe_id').values_list(
+            'pub_date', 'recipe_id')[:limit]]
+        if popular:
+            sources.append(recipes.order_by('-pub_date', '-id').values_list(
+                'pub_date', 'id')[:limit])
+        rows = (row for row, _ in groupby(merge(*sources, reverse=True)))
+        return list(islice(rows, limit))
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписок пользователя"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             verbose_name='Подписчик',
+                             related_name='feed')
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               verbose_name='Рецепт', related_name='+')
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               verbose_name='Автор', related_name='+')
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    objects = FeedEntryManager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='feed_entry_user_idx'),
+        ]
+        constraints = (
+            models.UniqueConstraint(fields=('user', 'recipe'),
+                                    name='unique_recipe_in_feed'),
+        )
+
+    def __str__(self):
+        return f'{self.user} {self.recipe}'
+
+
+class RecipeSimilarity(models.Model):
+    """Похожий рецепт из заранее посчитанного списка соседей"""
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               verbose_name='Рецепт', related_name='+')
+    similar = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                                verbose_name='Похожий рецепт',
+                                related_name='+')
+    score = models.FloatField(verbose_name='Сходство')
+    computed = models.DateTimeField(verbose_name='Дата расчёта',
+                                    auto_now=True)
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        indexes = [
+            models.Index(fields=['recipe', '-score'],
+                         name='recipe_similarity_idx'),
+        ]
+        constraints = (
+            models.UniqueConstraint(fields=('recipe', 'similar'),
+                                    name='unique_similar_recipe'),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} {self.similar} {self.score}'
@@ -0,0 +1,243 @@
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from django.conf import settings
+
+from .cache import PANTRY, read_changes
+from .models import RecipeIngredient
+
+# Ингредиенты, которые есть хотя бы в каждом BITSET_DENSITY-м рецепте,
+# дополнительно хранятся битовой маской: собирать её из массива при
+# каждом запросе дороже, чем держать в памяти.
+BITSET_DENSITY = 64
+
+
+def bitset(ids):
+    buffer = bytearray((max(ids, default=0) >> 3) + 1)
+    for pk in ids:
+        buffer[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+class PantryMatches:
+    """
+    Рецепты, найденные по набору ингредиентов, в порядке убывания доли
+    имеющихся ингредиентов, затем их числа, затем новизны. Ведёт себя
+    как последовательность для Paginator: id рецептов извлекаются из
+    масок только для запрошенного среза.
+    """
+
+    def __init__(self, counts, sizes, total):
+        self.total = total
+        self.groups = sorted(
+            ((have, size) for have in counts for size in sizes
+             if have <= size),
+            key=lambda group: (-group[0] / group[1], -group[0])
+        )
+        self.counts = counts
+        self.sizes = sizes
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, index):
+        start, stop, _ = index.indices(self.total)
+        count = stop - start
+        found = []
+        for have, size in self.groups:
+            if len(found) >= count:
+                break
+            mask = self.counts[have] & self.sizes[size]
+            if not mask:
+                continue
+            bits = popcount(mask)
+            if start >= bits:
+                start -= bits
+                continue
+            while mask and len(found) < count:
+                pk = mask.bit_length() - 1
+                mask ^= 1 << pk
+                if start:
+                    start -= 1
+                else:
+                    found.append(pk)
+            start = 0
+        return found
+
+
+class PantryIndex:
+    """
+    Обратный индекс ингредиент → рецепты в памяти процесса для поиска
+    «что приготовить из того, что есть».
+
+    Для каждого ингредиента хранит отсортированный массив id рецептов,
+    для частых ингредиентов — ещё и битовую маску по id. Запрос
+    складывает маски ингредиентов поразрядно (по одной маске на разряд
+    счётчика), поэтому стоит несколько десятков операций над целыми
+    числами независимо от того, в скольких рецептах встречаются
+    ингредиенты. Изменения рецептов процессы читают из журнала
+    изменений в кеше и применяют точечно.
+
+    Чтобы при изменении рецепта править только массивы его прежних
+    ингредиентов, индекс помнит состав рецептов: загруженный — одним
+    массивом, сгруппированным по рецептам, с массивом смещений, а
+    изменённый после загрузки — в словаре.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._epoch = None
+        self._number = 0
+        self._recipes = {}
+        self._bitsets = {}
+        self._sizes = array('H')
+        self._size_masks = {}
+        self._offsets = array('I', [0])
+        self._members = array('I')
+        self._changed = {}
+
+    def _dense(self, ids):
+        return len(ids) * BITSET_DENSITY > len(self._sizes)
+
+    def load(self, rows):
+        """Строит индекс по парам (id рецепта, id ингредиента)."""
+        recipes = defaultdict(list)
+        sizes = defaultdict(int)
+        for recipe_id, ingredient_id in rows:
+            recipes[ingredient_id].append(recipe_id)
+            sizes[recipe_id] += 1
+        self._sizes = array('H', bytes(2 * (max(sizes, default=0) + 1)))
+        by_size = defaultdict(list)
+        for recipe_id, size in sizes.items():
+            self._sizes[recipe_id] = size
+            by_size[size].append(recipe_id)
+        self._size_masks = {
+            size: bitset(ids) for size, ids in by_size.items()
+        }
+        self._recipes = {
+            ingredient_id: array('I', sorted(ids))
+            for ingredient_id, ids in recipes.items()
+        }
+        self._bitsets = {
+            ingredient_id: bitset(ids)
+            for ingredient_id, ids in self._recipes.items()
+            if self._dense(ids)
+        }
+        self._offsets = array('I', [0])
+        for size in self._sizes:
+            self._offsets.append(self._offsets[-1] + size)
+        self._members = array('I', bytes(4 * self._offsets[-1]))
+        positions = self._offsets[:-1]
+        for ingredient_id, ids in self._recipes.items():
+            for recipe_id in ids:
+                self._members[positions[recipe_id]] = ingredient_id
+                positions[recipe_id] += 1
+        self._changed = {}
+
+    def _ingredients(self, recipe_id):
+        if recipe_id in self._changed:
+            return self._changed[recipe_id]
+        if recipe_id + 1 >= len(self._offsets):
+            return ()
+        return self._members[
+            self._offsets[recipe_id]:self._offsets[recipe_id + 1]]
+
+    def _remove(self, recipe_id):
+        if recipe_id >= len(self._sizes) or not self._sizes[recipe_id]:
+            return
+        bit = 1 << recipe_id
+        size = self._sizes[recipe_id]
+        self._size_masks[size] &= ~bit
+        self._sizes[recipe_id] = 0
+        for ingredient_id in self._ingredients(recipe_id):
+            ids = self._recipes[ingredient_id]
+            position = bisect_left(ids, recipe_id)
+            if position < len(ids) and ids[position] == recipe_id:
+                del ids[position]
+                if ingredient_id in self._bitsets:
+                    self._bitsets[ingredient_id] &= ~bit
+        self._changed[recipe_id] = ()
+
+    def _add(self, recipe_id, ingredient_ids):
+        if not ingredient_ids:
+            return
+        if recipe_id >= len(self._sizes):
+            self._sizes.extend([0] * (recipe_id + 1 - len(self._sizes)))
+        bit = 1 << recipe_id
+        self._sizes[recipe_id] = len(ingredient_ids)
+        self._changed[recipe_id] = tuple(ingredient_ids)
+        self._size_masks[len(ingredient_ids)] = (
+            self._size_masks.get(len(ingredient_ids), 0) | bit)
+        for ingredient_id in ingredient_ids:
+            ids = self._recipes.setdefault(ingredient_id, array('I'))
+            insort(ids, recipe_id)
+            if ingredient_id in self._bitsets:
+                self._bitsets[ingredient_id] |= bit
+            elif self._dense(ids):
+                self._bitsets[ingredient_id] = bitset(ids)
+
+    def apply(self, recipe_ids):
+        """Перечитывает ингредиенты рецептов из базы; удалённые рецепты
+        и рецепты без ингредиентов исчезают из индекса."""
+        ingredients = defaultdict(list)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids).values_list(
+                    'recipe_id', 'ingredient_id'):
+            ingredients[recipe_id].append(ingredient_id)
+        for recipe_id in recipe_ids:
+            self._remove(recipe_id)
+            self._add(recipe_id, ingredients[recipe_id])
+
+    def ensure_fresh(self):
+        with self._lock:
+            epoch, number, changes = read_changes(
+                PANTRY, self._epoch, self._number,
+                settings.PANTRY_INDEX_MAX_CHANGES)
+            if (epoch, number) == (self._epoch, self._number):
+                return
+            if changes is None:
+                self.load(RecipeIngredient.objects.values_list(
+                    'recipe_id', 'ingredient_id').iterator())
+            else:
+                self.apply(set(changes))
+            self._epoch, self._number = epoch, number
+
+    def _bitset(self, ingredient_id):
+        if ingredient_id in self._bitsets:
+            return self._bitsets[ingredient_id]
+        return bitset(self._recipes.get(ingredient_id, ()))
+
+    def search(self, ingredient_ids):
+        with self._lock:
+            masks = [self._bitset(pk) for pk in set(ingredient_ids)]
+            sizes = dict(self._size_masks)
+        # Поразрядное сложение масок: planes[i] — i-й бит счётчика
+        # имеющихся ингредиентов у каждого рецепта.
+        planes = []
+        found = 0
+        for mask in masks:
+            found |= mask
+            carry = mask
+            for position, plane in enumerate(planes):
+                if not carry:
+                    break
+                planes[position], carry = plane ^ carry, plane & carry
+            if carry:
+                planes.append(carry)
+        counts = {}
+        for have in range(1, min(len(masks) + 1, 1 << len(planes))):
+            mask = found
+            for position, plane in enumerate(planes):
+                mask &= plane if have >> position & 1 else ~plane
+            if mask:
+                counts[have] = mask
+        return PantryMatches(counts, sizes, popcount(found))
+
+
+pantry_index = PantryIndex()
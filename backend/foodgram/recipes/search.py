@@ -0,0 +1,278 @@
+import heapq
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .cache import INGREDIENTS, RECIPES, bump_version, get_version
+from .models import Ingredient, Recipe
+
+WORD_START = re.compile(r'\b\w')
+WORD = re.compile(r'\w+')
+# Слова запроса короче этого ищутся только целиком, длиннее — и как
+# начало слова, что заменяет стемминг.
+PREFIX_MIN_LENGTH = 3
+NAME_WEIGHT = 2
+SEARCH_CONFIG = 'russian'
+# Миграция 0012 строит индекс recipe_search_idx по копии этого
+# выражения. Если выражение или SEARCH_CONFIG меняются, индекс нужно
+# пересоздать новой миграцией, иначе PostgreSQL не сможет им
+# воспользоваться.
+SEARCH_DOCUMENT = (
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', {{name}}), 'A') || "
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', {{text}}), 'B')"
+)
+
+
+def normalize(value):
+    return value.casefold().replace('ё', 'е')
+
+
+class IngredientSearchIndex:
+    """
+    Индекс названий ингредиентов в памяти процесса для автодополнения.
+
+    Хранит два отсортированных массива: названия целиком и хвосты
+    названий, начинающиеся с каждого следующего слова. Поиск — бинарный
+    по обоим массивам, поэтому стоит O(log n + limit): сначала идут
+    совпадения с началом названия, затем с началом любого другого слова.
+    Индекс перестраивается, когда меняется версия справочника
+    ингредиентов в кеше.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._tiers = ()
+
+    def load(self, rows):
+        """Строит индекс по парам (id, название)."""
+        names = sorted((normalize(name), pk) for pk, name in rows)
+        words = sorted(
+            (name[match.start():], pk)
+            for name, pk in names
+            for match in WORD_START.finditer(name)
+            if match.start()
+        )
+        self._tiers = tuple(
+            ([key for key, _ in tier], [pk for _, pk in tier])
+            for tier in (names, words)
+        )
+
+    def ensure_fresh(self):
+        version = get_version(INGREDIENTS)
+        if version == self._version:
+            return
+        with self._lock:
+            if version != self._version:
+                self.load(Ingredient.objects.values_list('id', 'name'))
+                self._version = version
+
+    def search(self, query, limit):
+        """Возвращает id не более чем limit ингредиентов в порядке
+        релевантности."""
+        query = normalize(query.strip())
+        if not query:
+            return []
+        found = {}
+        for keys, ids in self._tiers:
+            position = bisect_left(keys, query)
+            while (len(found) < limit and position < len(keys)
+                   and keys[position].startswith(query)):
+                found.setdefault(ids[position])
+                position += 1
+        return list(found)
+
+
+def tokenize(value):
+    return WORD.findall(normalize(value))
+
+
+class RecipeSearchIndex:
+    """
+    Инвертированный индекс названий и описаний рецептов в памяти
+    процесса — замена полнотекстовому поиску PostgreSQL на остальных
+    базах, прежде всего на SQLite в тестах и разработке.
+
+    Для каждого слова хранит рецепты и вес слова в них (совпадение
+    в названии весит NAME_WEIGHT). Все слова запроса обязательны,
+    рецепты ранжируются по tf-idf. Изменения рецептов в своём процессе
+    применяются точечно, остальные процессы по новой версии в кеше
+    перестраивают индекс целиком.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._postings = {}
+        self._documents = {}
+        self._tokens = []
+
+    def _add(self, pk, name, text, keep_sorted=True):
+        weights = Counter(tokenize(text))
+        for token in tokenize(name):
+            weights[token] += NAME_WEIGHT
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                if keep_sorted:
+                    insort(self._tokens, token)
+            postings[pk] = weight
+        self._documents[pk] = tuple(weights)
+
+    def _remove(self, pk):
+        for token in self._documents.pop(pk, ()):
+            postings = self._postings[token]
+            del postings[pk]
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect_left(self._tokens, token)]
+
+    def load(self, rows):
+        """Строит индекс по кортежам (id, название, описание)."""
+        self._postings = {}
+        self._documents = {}
+        for pk, name, text in rows:
+            self._add(pk, name, text, keep_sorted=False)
+        self._tokens = sorted(self._postings)
+
+    def ensure_fresh(self):
+        version = get_version(RECIPES)
+        if version == self._version:
+            return
+        with self._lock:
+            if version != self._version:
+                self.load(Recipe.objects.values_list(
+                    'id', 'name', 'text').iterator())
+                self._version = version
+
+    def apply(self, pk, name=None, text=None):
+        """Обновляет рецепт в индексе (без name — удаляет) и сдвигает
+        версию, чтобы другие процессы перестроили свои индексы."""
+        with self._lock:
+            fresh = (self._version is not None
+                     and self._version == get_version(RECIPES))
+            if fresh:
+                self._remove(pk)
+                if name is not None:
+                    self._add(pk, name, text)
+            version = bump_version(RECIPES)
+            if fresh:
+                self._version = version
+
+    def postings(self, term):
+        """Списки рецептов для всех слов, подходящих под слово запроса."""
+        if len(term) < PREFIX_MIN_LENGTH:
+            return [self._postings[term]] if term in self._postings else []
+        found = []
+        position = bisect_left(self._tokens, term)
+        while (position < len(self._tokens)
+               and self._tokens[position].startswith(term)):
+            found.append(self._postings[self._tokens[position]])
+            position += 1
+        return found
+
+    def search(self, query, limit):
+        """Возвращает id не более чем limit рецептов, подходящих под все
+        слова запроса, в порядке релевантности."""
+        # Индекс меняется на месте, поэтому читать его можно только
+        # под блокировкой.
+        with self._lock:
+            return self._search(query, limit)
+
+    def _search(self, query, limit):
+        terms = [self.postings(term) for term in set(tokenize(query))]
+        if not terms or not all(terms):
+            return []
+        # Начинаем с самого редкого слова: остальные проверяются
+        # только для уже найденных рецептов, а не целиком.
+        terms.sort(key=lambda lists: sum(map(len, lists)))
+        total = len(self._documents) + 1
+        scores = {}
+        for postings in terms[0]:
+            for pk, weight in postings.items():
+                scores[pk] = scores.get(pk, 0) + weight
+        idf = math.log(1 + total / len(scores))
+        scores = {pk: weight * idf for pk, weight in scores.items()}
+        for lists in terms[1:]:
+            idf = math.log(1 + total / sum(map(len, lists)))
+            matched = {}
+            for pk, score in scores.items():
+                weight = sum(postings.get(pk, 0) for postings in lists)
+                if weight:
+                    matched[pk] = score + weight * idf
+            scores = matched
+            if not scores:
+                return []
+        return heapq.nlargest(limit, scores,
+                              key=lambda pk: (scores[pk], pk))
+
+
+ingredient_index = IngredientSearchIndex()
+recipe_index = RecipeSearchIndex()
+
+
+def uses_database_search():
+    return connection.vendor == 'postgresql'
+
+
+def order_by_ids(queryset, ids):
+    """Оставляет записи с указанными id в том же порядке."""
+    if not ids:
+        return queryset.none()
+    # Простой CASE одним RawSQL: When на каждый id в ORM собирается
+    # в разы дольше, чем выполняется сам запрос.
+    meta = queryset.model._meta
+    quote = connection.ops.quote_name
+    column = f'{quote(meta.db_table)}.{quote(meta.pk.column)}'
+    whens = ' '.join(['WHEN %s THEN %s'] * len(ids))
+    return queryset.filter(pk__in=ids).order_by(RawSQL(
+        f'CASE {column} {whens} END',
+        [value for position, pk in enumerate(ids)
+         for value in (pk, position)]
+    ))
+
+
+def search_recipes(queryset, query):
+    """
+    Рецепты, подходящие под запрос, по убыванию релевантности. На
+    PostgreSQL — полнотекстовый поиск по GIN-индексу, на остальных
+    базах — по индексу в памяти, не больше RECIPE_SEARCH_LIMIT записей.
+    Остальные фильтры нужно применять к queryset до поиска: ограничение
+    считается среди уже отфильтрованных рецептов.
+    """
+    if not uses_database_search():
+        recipe_index.ensure_fresh()
+        limit = settings.RECIPE_SEARCH_LIMIT
+        if not queryset.query.has_filters():
+            return order_by_ids(queryset, recipe_index.search(query, limit))
+        # Кандидаты проверяются фильтрами в базе пачками по limit в порядке
+        # релевантности, пока не наберётся limit подходящих.
+        candidates = recipe_index.search(
+            query, settings.RECIPE_SEARCH_CANDIDATES)
+        found = []
+        for start in range(0, len(candidates), limit):
+            batch = candidates[start:start + limit]
+            matched = set(queryset.filter(pk__in=batch).values_list(
+                'pk', flat=True))
+            found.extend(pk for pk in batch if pk in matched)
+            if len(found) >= limit:
+                break
+        return order_by_ids(queryset, found[:limit])
+    quote = connection.ops.quote_name
+    table = quote(Recipe._meta.db_table)
+    document = SEARCH_DOCUMENT.format(
+        name=f'{table}.{quote("name")}', text=f'{table}.{quote("text")}')
+    search_query = 'plainto_tsquery(%s, %s)'
+    return queryset.annotate(search_rank=RawSQL(
+        f'ts_rank({document}, {search_query})', (SEARCH_CONFIG, query)
+    )).extra(
+        where=[f'{document} @@ {search_query}'],
+        params=[SEARCH_CONFIG, query],
+    ).order_by('-search_rank', '-pub_date')
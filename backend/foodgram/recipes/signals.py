@@ -0,0 +1,49 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import INGREDIENTS, PANTRY, TAGS, bump_version, log_change
+from .models import Ingredient, Recipe, Tag
+from .search import recipe_index, uses_database_search
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredients_changed(**kwargs):
+    bump_version(INGREDIENTS)
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(**kwargs):
+    # Вместе с ингредиентом удаляются его строки во всех рецептах.
+    bump_version(PANTRY)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tags_changed(**kwargs):
+    bump_version(TAGS)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(instance, update_fields=None, **kwargs):
+    if uses_database_search():
+        return
+    if update_fields and not {'name', 'text'} & set(update_fields):
+        return
+    pk, name, text = instance.pk, instance.name, instance.text
+    transaction.on_commit(lambda: recipe_index.apply(pk, name, text))
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    if uses_database_search():
+        return
+    pk = instance.pk
+    transaction.on_commit(lambda: recipe_index.apply(pk))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_ingredients_changed(instance, **kwargs):
+    """Ингредиенты сохраняются в той же транзакции, что и рецепт,
+    поэтому журнал пополняется после её завершения."""
+    pk = instance.pk
+    transaction.on_commit(lambda: log_change(PANTRY, pk))
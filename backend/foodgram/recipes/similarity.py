@@ -0,0 +1,95 @@
+import heapq
+import math
+from collections import Counter, defaultdict
+
+from .models import Favorite, RecipeIngredient
+
+FAVORITE_WEIGHT = 0.7
+INGREDIENT_WEIGHT = 0.3
+
+
+class SimilarityBuilder:
+    """
+    Сходство рецептов «item-item» по двум разреженным признакам:
+
+    * избранное — косинус между множествами пользователей, добавивших
+      рецепты в избранное (число общих поклонников, делённое на корень
+      из произведения числа поклонников);
+    * ингредиенты — косинус между векторами ингредиентов с весами idf,
+      так что совпадение редких ингредиентов важнее, чем соли и воды.
+
+    Произведения считаются только для пар, у которых есть общий
+    пользователь или общий ингредиент: по спискам «пользователь →
+    рецепты» и «ингредиент → рецепты», как при умножении разреженных
+    матриц. Ингредиенты, которые есть больше чем в max_ingredient_recipes
+    рецептах, и избранное сверх max_user_favorites последних рецептов
+    пользователя пропускаются: они дают квадратичное число пар и почти
+    ничего не говорят о сходстве.
+    """
+
+    def __init__(self, top, max_ingredient_recipes=1000,
+                 max_user_favorites=500):
+        self.top = top
+        self.max_ingredient_recipes = max_ingredient_recipes
+        self.max_user_favorites = max_user_favorites
+
+    def load(self):
+        self.favorites = defaultdict(list)
+        self.fans = defaultdict(list)
+        for user_id, recipe_id in Favorite.objects.order_by(
+                '-created').values_list('user_id', 'recipe_id').iterator():
+            if len(self.favorites[user_id]) < self.max_user_favorites:
+                self.favorites[user_id].append(recipe_id)
+                self.fans[recipe_id].append(user_id)
+        self.ingredients = defaultdict(list)
+        self.recipes_with = defaultdict(list)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.values_list(
+                'recipe_id', 'ingredient_id').iterator():
+            self.ingredients[recipe_id].append(ingredient_id)
+            self.recipes_with[ingredient_id].append(recipe_id)
+        total = len(self.ingredients)
+        self.idf = {
+            ingredient_id: math.log(total / len(recipes))
+            for ingredient_id, recipes in self.recipes_with.items()
+        }
+        self.norms = {
+            recipe_id: math.sqrt(sum(
+                self.idf[ingredient_id] ** 2 for ingredient_id in ingredients))
+            for recipe_id, ingredients in self.ingredients.items()
+        }
+
+    def recipes(self):
+        return self.fans.keys() | self.ingredients.keys()
+
+    def scores(self, recipe_id):
+        """Сходство рецепта со всеми рецептами, у которых есть общий
+        поклонник или общий не слишком частый ингредиент."""
+        scores = {}
+        fans = self.fans.get(recipe_id, ())
+        common = Counter()
+        for user_id in fans:
+            common.update(self.favorites[user_id])
+        for other, count in common.items():
+            scores[other] = FAVORITE_WEIGHT * count / math.sqrt(
+                len(fans) * len(self.fans[other]))
+        norm = self.norms.get(recipe_id)
+        if norm:
+            products = defaultdict(float)
+            for ingredient_id in self.ingredients[recipe_id]:
+                recipes = self.recipes_with[ingredient_id]
+                if len(recipes) > self.max_ingredient_recipes:
+                    continue
+                weight = self.idf[ingredient_id] ** 2
+                for other in recipes:
+                    products[other] += weight
+            for other, product in products.items():
+                if self.norms[other]:
+                    scores[other] = scores.get(other, 0) + (
+                        INGREDIENT_WEIGHT * product
+                        / (norm * self.norms[other]))
+        scores.pop(recipe_id, None)
+        return scores
+
+    def best(self, scores):
+        return heapq.nlargest(self.top, scores.items(),
+                              key=lambda item: (item[1], item[0]))
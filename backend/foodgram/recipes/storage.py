@@ -0,0 +1,56 @@
+import hashlib
+import os
+from uuid import uuid4
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище, в котором имя файла — sha256 его содержимого:
+    recipes/ab/abcdef….png. Повторная загрузка той же картинки не создаёт
+    новый файл, а возвращает имя уже сохранённого. Файлы, на которые
+    больше не ссылается ни один рецепт, удаляет команда
+    collect_orphaned_images.
+    """
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content_hash = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(os.path.dirname(name), content_hash[:2],
+                            content_hash + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            # Обновляем время изменения, чтобы сборщик мусора не удалил
+            # файл, на который вот-вот сошлётся новый рецепт.
+            os.utime(self.path(name))
+            return name
+        return self._save(name, content)
+
+    def _save(self, name, content):
+        """
+        Пишет файл под временным именем и ссылается на него готовым
+        именем: параллельная загрузка той же картинки не получит
+        имя с суффиксом, а читатели не увидят недописанный файл. Если
+        файл с таким хешем уже появился, возвращается его имя.
+        """
+        temporary = super()._save(f'{name}.{uuid4().hex}.part', content)
+        try:
+            os.link(self.path(temporary), self.path(name))
+        except FileExistsError:
+            os.utime(self.path(name))
+        finally:
+            self.delete(temporary)
+        return name
@@ -0,0 +1,217 @@
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase
+from recipes.cache import clear_caches
+from recipes.management.commands.benchmark_api import Command
+from recipes.management.commands.export_recipes import recipe_to_dict
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.pantry import PantryIndex
+
+User = get_user_model()
+
+# Сколько запросов к базе делает каждый сценарий benchmark_api. Число
+# не должно зависеть от объёма данных, поэтому проверяется на маленькой
+# базе; рост числа означает появление N+1 или лишнего запроса.
+QUERY_BUDGETS = {
+    'recipe_list': 5,
+    'recipe_list_anonymous': 4,
+    'recipe_detail': 4,
+    'recipe_search': 5,
+    'pantry': 4,
+    'similar': 5,
+    'ingredient_search': 1,
+    'subscriptions': 3,
+    'feed': 6,
+    'favorite_toggle': 11,
+    'cart_toggle': 13,
+    'download_shopping_cart': 2,
+}
+
+
+class BenchmarkQueriesTest(TransactionTestCase):
+    """Сценарии benchmark_api на маленьком наборе данных. Тест работает
+    вне транзакции, как сама команда, чтобы точки сохранения не
+    попадали в число запросов."""
+
+    def setUp(self):
+        clear_caches()
+
+    def test_query_budgets(self):
+        command = Command(stdout=io.StringIO())
+        options = vars(command.create_parser(
+            'manage.py', 'benchmark_api').parse_args([
+                '--users', '20', '--recipes', '60', '--ingredients', '40',
+                '--tags', '5', '--iterations', '2',
+            ]))
+        results = command.run_scenarios(options)
+        self.assertEqual(set(results), set(QUERY_BUDGETS))
+        for name, budget in QUERY_BUDGETS.items():
+            with self.subTest(scenario=name):
+                self.assertEqual(results[name]['queries'], budget)
+                self.assertGreater(results[name]['rps'], 0)
+
+
+class ImportExportTest(TestCase):
+    """Рецепты, выгруженные export_recipes, загружаются import_recipes
+    без потерь."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author',
+                                         email='author@example.com')
+        tags = [
+            Tag.objects.create(name=f'Тег {number}', color=f'#00000{number}',
+                               slug=f'tag{number}')
+            for number in range(2)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}',
+                text=f'Описание {number}', cooking_time=number + 5,
+                image=f'recipes/{number}.png')
+            Recipe.objects.filter(pk=recipe.pk).update(pub_date=datetime(
+                2021, 1, number + 1, 12, tzinfo=timezone.utc))
+            recipe.tags.set(tags[:number])
+            RecipeIngredient.objects.bulk_create([
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=(number + 1) * 10)
+                for ingredient in ingredients[number:]
+            ])
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'recipes.jsonl')
+        self.addCleanup(shutil.rmtree, directory)
+
+    def exported(self):
+        return [recipe_to_dict(recipe)
+                for recipe in Recipe.objects.order_by('pub_date')]
+
+    def write(self, *records):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def test_round_trip(self):
+        before = self.exported()
+        call_command('export_recipes', self.path, stdout=io.StringIO())
+        Recipe.objects.all().delete()
+        call_command('import_recipes', self.path, stdout=io.StringIO())
+        self.assertEqual(self.exported(), before)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 3)
+
+    def test_repeated_tags_are_saved_once(self):
+        record = self.exported()[2]
+        self.write(dict(record, tags=record['tags'] * 2))
+        call_command('import_recipes', self.path, stdout=io.StringIO())
+        recipe = Recipe.objects.latest('pk')
+        self.assertEqual(
+            sorted(recipe.tags.values_list('slug', flat=True)),
+            record['tags'])
+
+    def test_invalid_row_is_reported_with_line_number(self):
+        record = self.exported()[0]
+        self.write(record, dict(record, cooking_time='долго'))
+        with self.assertRaisesMessage(CommandError, 'Строка 2'):
+            call_command('import_recipes', self.path, stdout=io.StringIO())
+
+
+class LoadIngredientsTest(TestCase):
+    """Загрузка ингредиентов из csv."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.path = os.path.join(directory, 'ingredients.csv')
+        self.addCleanup(shutil.rmtree, directory)
+
+    def load(self, *lines):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        call_command('load_ingredients', self.path, stdout=io.StringIO())
+
+    def test_load(self):
+        self.load('name,measurement_unit', 'соль,г', '', 'соль,г',
+                  'молоко, мл')
+        self.assertEqual(
+            set(Ingredient.objects.values_list('name', 'measurement_unit')),
+            {('соль', 'г'), ('молоко', 'мл')})
+
+    def test_wrong_columns_are_reported_with_line_number(self):
+        for line in ('соль', 'соль,г,лишнее'):
+            with self.assertRaisesMessage(
+                    CommandError, 'Строка 3: ожидается 2 столбца'):
+                self.load('соль,г', 'перец,г', line)
+        self.assertFalse(Ingredient.objects.exists())
+
+
+class PantryIndexTest(TestCase):
+    """Точечно обновлённый индекс продуктов совпадает с построенным
+    заново."""
+
+    def setUp(self):
+        self.random = random.Random(0)
+        author = User.objects.create(username='author',
+                                     email='author@example.com')
+        self.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(8)
+        ]
+        self.recipes = [
+            Recipe.objects.create(author=author, name=f'Рецепт {number}',
+                                  text='Описание', cooking_time=10)
+            for number in range(30)
+        ]
+        for recipe in self.recipes:
+            self.set_ingredients(recipe)
+
+    def set_ingredients(self, recipe, count=None):
+        RecipeIngredient.objects.filter(recipe=recipe).delete()
+        if count is None:
+            count = self.random.randint(1, 5)
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+            for ingredient in self.random.sample(self.ingredients, count)
+        ])
+
+    @staticmethod
+    def loaded():
+        index = PantryIndex()
+        index.load(RecipeIngredient.objects.values_list(
+            'recipe_id', 'ingredient_id'))
+        return index
+
+    def results(self, index):
+        pantries = [self.ingredients[:number] for number in range(1, 9)]
+        pantries += [[ingredient] for ingredient in self.ingredients]
+        results = []
+        for pantry in pantries:
+            matches = index.search([ingredient.pk for ingredient in pantry])
+            results.append((len(matches), matches[0:len(matches)]))
+        return results
+
+    def test_apply_matches_full_load(self):
+        index = self.loaded()
+        for _ in range(3):
+            changed = self.random.sample(self.recipes, 10)
+            for recipe in changed[:3]:
+                self.set_ingredients(recipe, count=0)
+            for recipe in changed[3:]:
+                self.set_ingredients(recipe)
+            index.apply([recipe.pk for recipe in changed])
+            self.assertEqual(self.results(index), self.results(self.loaded()))
@@ -9,6 +9,8 @@ class User(AbstractUser):
     last_name = models.CharField('Фамилия', max_length=150, null=True)
     first_name = models.CharField('Имя', max_length=150, null=True)
     password = models.CharField('Пароль', max_length=150)
+    recipes_count = models.PositiveIntegerField('Рецептов', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']